@@ -9,6 +9,8 @@ python manage.py collectstatic --no-input
 
 python manage.py migrate
 
+python manage.py refresh_effective_prices
+
 if [[ $CREATE_SUPERUSER ]];
 then
   python manage.py createsuperuser --no-input
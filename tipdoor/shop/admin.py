@@ -9,3 +9,4 @@ admin.site.register(models.Customer)
 admin.site.register(models.Cart)
 admin.site.register(models.CartItem)
 admin.site.register(models.OrderItem)
+admin.site.register(models.OutboxMessage)
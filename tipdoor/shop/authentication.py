@@ -0,0 +1,100 @@
+"""
+JWT authentication with the user cached between requests.
+
+simplejwt loads auth_user on every request, and the customer or vendor
+profile costs another query wherever a view or permission touches it. Here
+the user is loaded once together with both profiles and their fields are
+kept in the cache for AUTH_USER_CACHE_TIMEOUT seconds, so authenticating
+and authorizing a request usually costs no query. The password hash is not
+cached: a user rebuilt from the cache has it deferred, and saving that user
+leaves it untouched. Saving or deleting the user or one of its profiles
+evicts the entry (see shop.signals); changes made with QuerySet.update()
+show up when it expires.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+PROFILES = ('customer', 'vendor')
+
+
+def user_cache_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def _fields(instance, exclude=()):
+    return {
+        field.attname: field.value_from_object(instance)
+        for field in instance._meta.concrete_fields
+        if field.name not in exclude
+    }
+
+
+def _from_fields(model, fields, db):
+    # Fields left out, such as the password, are deferred like with .only()
+    return model.from_db(db, list(fields), list(fields.values()))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        key = user_cache_key(user_id)
+        data = cache.get(key)
+        if data is None:
+            try:
+                user = self.user_model.objects.select_related(*PROFILES).get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            data = self.dump_user(user)
+            cache.set(key, data, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            user = self.load_user(data)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != data['password_md5']:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def dump_user(self, user):
+        data = {
+            'user': _fields(user, exclude=('password',)),
+            # What tokens carry for revocation, rather than the hash itself
+            'password_md5': get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None,
+        }
+        for name in PROFILES:
+            # Missing profiles are cached too, so hasattr(user, 'vendor') stays query-free
+            profile = getattr(user, name, None)
+            data[name] = _fields(profile) if profile is not None else None
+        return data
+
+    def load_user(self, data):
+        db = self.user_model.objects.db
+        user = _from_fields(self.user_model, data['user'], db)
+        for name in PROFILES:
+            relation = self.user_model._meta.get_field(name)
+            profile = None
+            if data[name] is not None:
+                profile = _from_fields(relation.related_model, data[name], db)
+                relation.field.set_cached_value(profile, user)
+            relation.set_cached_value(user, profile)
+        return user
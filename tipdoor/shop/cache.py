@@ -0,0 +1,93 @@
+"""
+Versioned cache for catalog responses.
+
+Every cached catalog entry is keyed by a catalog epoch made of:
+
+- the catalog version, bumped by signals whenever a Product, a Promotion or
+  a promotion's product list changes, and
+- the last promotion start/end boundary that has passed, so entries roll
+  over on their own the moment a promotion opens or closes.
+
+Checkout and cancellation move stock without touching the epoch, so they do
+not flush the whole catalog; they only advance the products' updated_at.
+Views whose responses show stock add that to their key as well.
+"""
+
+import datetime
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .models import Product, Promotion
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    # Kept apart from the entries it versions, so culling them cannot reset it
+    versions = caches[settings.VERSION_CACHE]
+    version = versions.get(CATALOG_VERSION_KEY)
+    if version is None:
+        versions.add(CATALOG_VERSION_KEY, time.time(), None)
+        version = versions.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    caches[settings.VERSION_CACHE].set(CATALOG_VERSION_KEY, time.time(), None)
+
+
+def get_promotion_window(version=None, now=None):
+    """Returns (last, next) promotion boundaries around now, either may be None"""
+    version = version or get_catalog_version()
+    now = now or timezone.now()
+    key = f'catalog:window:{version}'
+
+    window = cache.get(key)
+    if window is None or (window[1] is not None and window[1] <= now):
+        # A promotion is live while start_date <= now <= end_date
+        boundaries = Promotion.objects.filter(is_active=True).aggregate(
+            last_start=Max('start_date', filter=Q(start_date__lte=now)),
+            last_end=Max('end_date', filter=Q(end_date__lt=now)),
+            next_start=Min('start_date', filter=Q(start_date__gt=now)),
+            next_end=Min('end_date', filter=Q(end_date__gte=now)),
+        )
+        last = max(filter(None, [boundaries['last_start'], boundaries['last_end']]), default=None)
+        upcoming = min(filter(None, [boundaries['next_start'], boundaries['next_end']]), default=None)
+        window = (last, upcoming)
+
+        timeout = None
+        if upcoming is not None:
+            timeout = max(1, math.ceil((upcoming - now).total_seconds()))
+        cache.set(key, window, timeout)
+    return window
+
+
+def get_catalog_epoch():
+    version = get_catalog_version()
+    last, _ = get_promotion_window(version)
+    return f'{version}:{last.timestamp() if last else 0}'
+
+
+def get_catalog_last_modified():
+    """Latest moment the catalog as a whole could have changed"""
+    version = get_catalog_version()
+    last, _ = get_promotion_window(version)
+    changed = datetime.datetime.fromtimestamp(version, tz=datetime.timezone.utc)
+    return max(changed, last) if last else changed
+
+
+def get_products_last_updated():
+    """Latest updated_at of a published product, stock changes included"""
+    return Product.objects.filter(is_published=True).aggregate(last_updated=Max('updated_at'))['last_updated']
+
+
+def catalog_cache_key(request, prefix, version=None):
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:{prefix}:{get_catalog_epoch()}:{version}:{digest}'
+
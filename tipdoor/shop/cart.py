@@ -0,0 +1,310 @@
+"""
+Cart storage.
+
+Customer carts live in the database. Guest carts are kept in the "carts"
+cache (Redis in production, local memory or files otherwise) under a random
+token stored in the session, and expire GUEST_CART_TTL after their last
+change. A guest cart only reaches the database when it is merged into the
+customer's cart at login.
+
+Changes to a guest cart re-read it and save it under a lock on its token,
+so two requests from the same visitor cannot overwrite each other's lines.
+"""
+
+import contextlib
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .locks import cache_lock
+from .models import Cart, CartItem, Product
+from .promotions import CENT
+
+GUEST_CART_SESSION_KEY = 'guest_cart'
+
+
+class CacheCartStore:
+    """Keeps guest cart payloads in a Django cache with a TTL"""
+
+    def __init__(self, alias, timeout):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, token):
+        return f'guest-cart:{token}'
+
+    def load(self, token):
+        return self.cache.get(self.key(token))
+
+    def save(self, token, data):
+        self.cache.set(self.key(token), data, self.timeout)
+
+    def delete(self, token):
+        self.cache.delete(self.key(token))
+
+
+def get_cart_store():
+    return CacheCartStore(settings.GUEST_CART_CACHE, settings.GUEST_CART_TTL)
+
+
+class GuestCart:
+    """
+    An anonymous visitor's cart. It serializes like a Cart without an id;
+    its lines are unsaved CartItems whose ids are numbered within the cart.
+    """
+
+    id = pk = None
+    customer = None
+
+    def __init__(self, token=None, lines=None, next_id=1, created_at=None, updated_at=None):
+        self.token = token
+        # False until the cart is first saved to the store
+        self.stored = updated_at is not None
+        # [line id, product id, quantity]
+        self.lines = lines or []
+        self.next_id = next_id
+        self.created_at = created_at or timezone.now()
+        self.updated_at = updated_at or self.created_at
+        self._products = {}
+
+    @property
+    def items(self):
+        missing = {product_id for _, product_id, _ in self.lines} - set(self._products)
+        if missing:
+            self._products.update(Product.objects.in_bulk(missing))
+        return [
+            CartItem(id=line_id, product=self._products[product_id], quantity=quantity)
+            for line_id, product_id, quantity in self.lines
+            if product_id in self._products
+        ]
+
+    def add(self, product, quantity):
+        self._products[product.pk] = product
+        for line in self.lines:
+            if line[1] == product.pk:
+                line[2] += quantity
+                return
+        self.lines.append([self.next_id, product.pk, quantity])
+        self.next_id += 1
+
+    def set_quantity(self, line_id, quantity):
+        for line in self.lines:
+            if line[0] == line_id:
+                line[2] = quantity
+                return True
+        return False
+
+    def remove(self, line_id):
+        for index, line in enumerate(self.lines):
+            if line[0] == line_id:
+                del self.lines[index]
+                return True
+        return False
+
+    def refresh(self, data):
+        self.stored = True
+        self.lines = data['lines']
+        self.next_id = data['next_id']
+        self.created_at = data['created_at']
+        self.updated_at = data['updated_at']
+
+    def to_dict(self):
+        return {
+            'lines': self.lines,
+            'next_id': self.next_id,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+
+def get_guest_cart(request):
+    """The session's guest cart, or an empty unsaved one; never touches the database"""
+    token = request.session.get(GUEST_CART_SESSION_KEY)
+    data = get_cart_store().load(token) if token else None
+    if data is None:
+        return GuestCart(token=token)
+    return GuestCart(token=token, **data)
+
+
+def save_guest_cart(request, cart):
+    if cart.token is None:
+        cart.token = secrets.token_urlsafe(24)
+        request.session[GUEST_CART_SESSION_KEY] = cart.token
+    cart.updated_at = timezone.now()
+    get_cart_store().save(cart.token, cart.to_dict())
+    cart.stored = True
+
+
+def change_guest_cart(request, cart, change):
+    """
+    Applies change(cart) to the latest stored copy of the guest cart and saves
+    it, unless change returned False. Returns what change returned.
+    """
+    store = get_cart_store()
+    # Nobody else can have a cart that has no token yet
+    lock = cache_lock(store.cache, store.key(cart.token)) if cart.token else contextlib.nullcontext()
+    with lock:
+        if cart.token:
+            data = store.load(cart.token)
+            if data is not None:
+                cart.refresh(data)
+        result = change(cart)
+        if result is not False:
+            save_guest_cart(request, cart)
+    return result
+
+
+def delete_guest_cart(request, cart):
+    if cart.token:
+        get_cart_store().delete(cart.token)
+    request.session.pop(GUEST_CART_SESSION_KEY, None)
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        cart, _ = Cart.objects.get_or_create(customer=request.user.customer)
+        return cart
+    return get_guest_cart(request)
+
+
+def add_item(request, cart, product, quantity):
+    if isinstance(cart, GuestCart):
+        change_guest_cart(request, cart, lambda cart: cart.add(product, quantity))
+        return
+
+    # A one-operation batch, so concurrent adds are serialized on the cart row
+    apply_operations(request, cart, [{'op': 'add', 'product_id': product.pk, 'quantity': quantity}], {product.pk: product})
+
+
+def update_item(request, cart, item_id, quantity):
+    """Sets a line's quantity; returns False if the cart has no such line"""
+    if isinstance(cart, GuestCart):
+        return change_guest_cart(request, cart, lambda cart: cart.set_quantity(item_id, quantity))
+
+    try:
+        cart_item = CartItem.objects.get(id=item_id, cart=cart)
+    except CartItem.DoesNotExist:
+        return False
+    cart_item.quantity = quantity
+    cart_item.save()
+    return True
+
+
+def remove_item(request, cart, item_id):
+    """Removes a line; returns False if the cart has no such line"""
+    if isinstance(cart, GuestCart):
+        return change_guest_cart(request, cart, lambda cart: cart.remove(item_id))
+
+    try:
+        cart_item = CartItem.objects.get(id=item_id, cart=cart)
+    except CartItem.DoesNotExist:
+        return False
+    cart_item.delete()
+    return True
+
+
+def _final_quantities(current, operations):
+    """Replays operations over {product id: quantity}; returns the touched products' results"""
+    quantities = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['op'] == 'add':
+            quantities[product_id] = quantities.get(product_id, current.get(product_id, 0)) + operation['quantity']
+        elif operation['op'] == 'set':
+            quantities[product_id] = operation['quantity']
+        else:
+            quantities[product_id] = 0
+    return quantities
+
+
+def _apply_guest_operations(cart, operations, products):
+    current = {product_id: quantity for _, product_id, quantity in cart.lines}
+    final = _final_quantities(current, operations)
+    line_ids = {product_id: line_id for line_id, product_id, _ in cart.lines}
+    removed = []
+    for product_id, quantity in final.items():
+        if quantity:
+            if product_id in current:
+                cart.set_quantity(line_ids[product_id], quantity)
+            else:
+                cart.add(products[product_id], quantity)
+        elif product_id in current:
+            cart.remove(line_ids[product_id])
+            removed.append(line_ids[product_id])
+    return {product_id for product_id, quantity in final.items() if quantity}, removed
+
+
+def apply_operations(request, cart, operations, products):
+    """
+    Applies add/set/remove operations, in order, as one change to the cart.
+    Every touched line is written with a single upsert or delete. Returns the
+    product ids of the lines that changed and the ids of the removed lines.
+    """
+    if isinstance(cart, GuestCart):
+        return change_guest_cart(request, cart, lambda cart: _apply_guest_operations(cart, operations, products))
+
+    product_ids = {operation['product_id'] for operation in operations}
+    with transaction.atomic():
+        # Serializes concurrent batches on the same cart
+        list(Cart.objects.select_for_update().filter(pk=cart.pk).values_list('pk', flat=True))
+        lines = CartItem.objects.filter(cart=cart, product_id__in=product_ids).values_list('product_id', 'id', 'quantity')
+        line_ids, current = {}, {}
+        for product_id, line_id, quantity in lines:
+            line_ids[product_id], current[product_id] = line_id, quantity
+        final = _final_quantities(current, operations)
+
+        upserts = [
+            CartItem(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in final.items()
+            if quantity and quantity != current.get(product_id)
+        ]
+        removed = [line_ids[product_id] for product_id, quantity in final.items() if not quantity and product_id in current]
+        CartItem.objects.bulk_create(
+            upserts,
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        # bulk_create skips the signal that keeps Cart.updated_at current
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+    return {product_id for product_id, quantity in final.items() if quantity}, removed
+
+
+def merge_guest_cart(request, customer):
+    """
+    Moves the session's guest cart into the customer's cart, adding up the
+    quantities of products in both, with one read and one bulk upsert.
+    """
+    guest_cart = get_guest_cart(request)
+    if not guest_cart.lines:
+        return
+    items = guest_cart.items
+    if items:
+        cart, _ = Cart.objects.get_or_create(customer=customer)
+        operations = [{'op': 'add', 'product_id': item.product_id, 'quantity': item.quantity} for item in items]
+        apply_operations(request, cart, operations, {item.product_id: item.product for item in items})
+    delete_guest_cart(request, guest_cart)
+
+
+def cart_totals(items, resolver):
+    """Line count, units and totals before and after promotions for loaded cart lines"""
+    total = discounted_total = Decimal('0')
+    for item in items:
+        total += item.product.price * item.quantity
+        discounted_total += resolver.get_discounted_price(item.product) * item.quantity
+    return {
+        'lines': len(items),
+        'quantity': sum(item.quantity for item in items),
+        'total': str(total.quantize(CENT)),
+        'discounted_total': str(discounted_total.quantize(CENT)),
+    }
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db.models import Case, CharField, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import LOW_STOCK_THRESHOLD
+
+STOCK_FILTERS = {
+    'in_stock': Q(stock__gt=LOW_STOCK_THRESHOLD),
+    'low_stock': Q(stock__gt=0, stock__lte=LOW_STOCK_THRESHOLD),
+    'out_of_stock': Q(stock=0),
+}
+STOCK_STATUSES = tuple(STOCK_FILTERS)
+
+# Keyset orderings for each `sort` value; every one ends with the unique id
+PRODUCT_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'discounted_price': ('sort_price', 'id'),
+    '-discounted_price': ('-sort_price', '-id'),
+}
+
+
+def stock_status_expression():
+    return Case(
+        When(stock=0, then=Value('out_of_stock')),
+        When(stock__lte=LOW_STOCK_THRESHOLD, then=Value('low_stock')),
+        default=Value('in_stock'),
+        output_field=CharField(),
+    )
+
+
+def price_bucket_expression():
+    bounds = settings.PRODUCT_PRICE_BUCKETS
+    return Case(
+        *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+        output_field=IntegerField(),
+    )
+
+
+def filter_products(queryset, filters):
+    """Applies validated ProductFilterSerializer data to a product queryset"""
+    if filters.get('vendor'):
+        queryset = queryset.filter(vendor_id__in=filters['vendor'])
+    if filters.get('min_price') is not None:
+        queryset = queryset.filter(price__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        queryset = queryset.filter(price__lte=filters['max_price'])
+    if filters.get('stock'):
+        condition = Q()
+        for stock_status in filters['stock']:
+            condition |= STOCK_FILTERS[stock_status]
+        queryset = queryset.filter(condition)
+    if filters.get('on_promotion') is not None:
+        # The denormalized promotion, as for the discounted_price sort, so the two agree
+        queryset = queryset.filter(effective_price__promotion__isnull=not filters['on_promotion'])
+    if filters.get('sort') in ('discounted_price', '-discounted_price'):
+        queryset = queryset.annotate(sort_price=Coalesce(F('effective_price__discounted_price'), F('price')))
+    return queryset
+
+
+def product_facets(queryset):
+    """Counts products per vendor, price bucket and stock status in one grouped query"""
+    rows = queryset.annotate(
+        price_bucket=price_bucket_expression(),
+        stock_status=stock_status_expression(),
+    ).values('vendor_id', 'vendor__name', 'price_bucket', 'stock_status').annotate(count=Count('id')).order_by()
+
+    vendors, buckets, statuses = {}, {}, dict.fromkeys(STOCK_STATUSES, 0)
+    total = 0
+    for row in rows:
+        total += row['count']
+        vendor = vendors.setdefault(row['vendor_id'], {'id': row['vendor_id'], 'name': row['vendor__name'], 'count': 0})
+        vendor['count'] += row['count']
+        buckets[row['price_bucket']] = buckets.get(row['price_bucket'], 0) + row['count']
+        statuses[row['stock_status']] += row['count']
+
+    bounds = [0, *settings.PRODUCT_PRICE_BUCKETS, None]
+    return {
+        'total': total,
+        'vendors': sorted(vendors.values(), key=lambda vendor: (-vendor['count'], vendor['id'])),
+        'price_ranges': [
+            {'min': bounds[index], 'max': bounds[index + 1], 'count': buckets.get(index, 0)}
+            for index in range(len(bounds) - 1)
+        ],
+        'stock_status': [{'value': value, 'count': count} for value, count in statuses.items()],
+    }
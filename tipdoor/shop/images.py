@@ -0,0 +1,121 @@
+"""
+Resized WebP/JPEG derivatives for uploaded product and promotion images.
+
+Derivatives are generated off the request path by a small thread pool and
+stored under `derived/<content hash>/<width>.<ext>`. Since the path changes
+whenever the source bytes change, they are served with immutable caching.
+"""
+
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+            thread_name_prefix='image-derivatives'
+        )
+    return _executor
+
+
+def build_derivatives(image_file, widths):
+    """Writes the derivatives of `image_file` and returns their description"""
+    image_file.open('rb')
+    try:
+        data = image_file.read()
+    finally:
+        image_file.close()
+
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    variants = {'source': image_file.name, 'hash': digest}
+    for extension, _ in FORMATS:
+        variants[extension] = []
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    # Never upscale; widths above the original collapse to the original size
+    for width in sorted({min(width, image.width) for width in widths}):
+        if width < image.width:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        else:
+            resized = image
+        for extension, image_format in FORMATS:
+            name = f'derived/{digest}/{width}.{extension}'
+            if not default_storage.exists(name):
+                buffer = io.BytesIO()
+                resized.save(buffer, image_format, quality=settings.IMAGE_DERIVATIVE_QUALITY, optimize=True)
+                name = default_storage.save(name, ContentFile(buffer.getvalue()))
+            variants[extension].append([width, name])
+    return variants
+
+
+def needs_derivatives(instance, field_name, variants_field):
+    image_file = getattr(instance, field_name)
+    return (image_file.name or '') != getattr(instance, variants_field).get('source', '')
+
+
+def generate_derivatives(model, pk, field_name, variants_field, widths):
+    from .cache import bump_catalog_version
+
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None or not needs_derivatives(instance, field_name, variants_field):
+            return
+
+        image_file = getattr(instance, field_name)
+        variants = build_derivatives(image_file, widths) if image_file else {}
+
+        # Only store the result if the image was not replaced in the meantime
+        updated = model.objects.filter(pk=pk, **{field_name: image_file.name or ''}).update(**{variants_field: variants})
+        if updated:
+            bump_catalog_version()
+    except Exception:
+        logger.exception("Could not build image derivatives for %s %s", model.__name__, pk)
+    finally:
+        if settings.IMAGE_DERIVATIVES_ASYNC:
+            connection.close()
+
+
+def schedule_derivatives(instance, field_name, variants_field, widths):
+    args = (type(instance), instance.pk, field_name, variants_field, widths)
+    if settings.IMAGE_DERIVATIVES_ASYNC:
+        get_executor().submit(generate_derivatives, *args)
+    else:
+        generate_derivatives(*args)
+
+
+def image_srcset(variants, request=None):
+    """Returns a `srcset` string per format, e.g. {'webp': 'a.webp 320w, b.webp 640w'}"""
+    if not variants or not variants.get('source'):
+        return None
+
+    srcset = {}
+    for extension, _ in FORMATS:
+        candidates = []
+        for width, name in variants.get(extension, []):
+            url = default_storage.url(name)
+            if request:
+                url = request.build_absolute_uri(url)
+            candidates.append(f'{url} {width}w')
+        srcset[extension] = ', '.join(candidates)
+    return srcset
@@ -0,0 +1,177 @@
+"""
+Bulk product import for vendors.
+
+Rows are read one at a time from a CSV or JSON-lines stream, validated in
+chunks, and each chunk is written with one bulk_create and one bulk_update
+inside its own transaction. Only the current chunk is held in memory, so
+large files import in constant memory. Bulk writes skip model signals, so
+the caches, search indexes and effective prices are invalidated here.
+"""
+
+import csv
+import io
+import json
+import os
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .cache import bump_catalog_version
+from .models import Product
+from .promotions import refresh_effective_prices
+from .search import bump_search_version
+
+FORMATS = ('csv', 'jsonl')
+UPDATE_FIELDS = ('name', 'price', 'stock', 'is_published')
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=50)
+    name = serializers.CharField(max_length=200, required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    stock = serializers.IntegerField(min_value=0, required=False)
+    is_published = serializers.BooleanField(required=False)
+
+    def to_internal_value(self, data):
+        # Empty CSV cells mean "leave unchanged", not "set to blank"
+        data = {key: value for key, value in data.items() if key and value not in ('', None)}
+        return super().to_internal_value(data)
+
+
+def detect_format(name, content_type=None):
+    extension = os.path.splitext(name or '')[1].lower()
+    if extension == '.csv' or content_type == 'text/csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson') or content_type in ('application/jsonl', 'application/x-ndjson'):
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, file_format):
+    """Yields (line number, row dict or None, error) from a binary stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object"
+            continue
+        yield line_number, row, None
+
+
+class ProductImporter:
+    """Creates or updates a vendor's products keyed by SKU"""
+
+    def __init__(self, vendor, chunk_size=None, max_errors=None):
+        self.vendor = vendor
+        self.chunk_size = chunk_size or settings.PRODUCT_IMPORT_CHUNK_SIZE
+        self.max_errors = max_errors or settings.PRODUCT_IMPORT_MAX_ERRORS
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, stream, file_format):
+        chunk = []
+        for line_number, row, error in read_rows(stream, file_format):
+            if error:
+                self.add_error(line_number, None, error)
+                continue
+            chunk.append((line_number, row))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.report()
+
+    def report(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+    def add_error(self, line_number, sku, errors):
+        self.failed += 1
+        # Keep the report bounded too; the failed count stays exact
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, 'sku': sku, 'errors': errors})
+
+    def import_chunk(self, chunk):
+        rows = {}
+        for line_number, row in chunk:
+            serializer = ProductImportRowSerializer(data=row)
+            if not serializer.is_valid():
+                self.add_error(line_number, row.get('sku'), serializer.errors)
+                continue
+            data = serializer.validated_data
+            # A later row for the same SKU supersedes an earlier one
+            rows[data['sku']] = (line_number, data)
+        if not rows:
+            return
+
+        now = timezone.now()
+        existing = Product.objects.filter(sku__in=rows).only('id', 'sku', 'vendor_id', *UPDATE_FIELDS).in_bulk(field_name='sku')
+        to_create, to_update, fields = [], [], {'updated_at'}
+        for sku, (line_number, data) in rows.items():
+            product = existing.get(sku)
+            if product is None:
+                missing = [field for field in ('name', 'price') if field not in data]
+                if missing:
+                    self.add_error(line_number, sku, {field: ["This field is required for new products."] for field in missing})
+                    continue
+                to_create.append(Product(vendor=self.vendor, **data))
+            elif product.vendor_id != self.vendor.pk:
+                self.add_error(line_number, sku, {'sku': ["This SKU belongs to another vendor."]})
+            else:
+                for field in UPDATE_FIELDS:
+                    if field in data:
+                        setattr(product, field, data[field])
+                        fields.add(field)
+                # bulk_update does not apply auto_now
+                product.updated_at = now
+                to_update.append(product)
+
+        try:
+            with transaction.atomic():
+                created = Product.objects.bulk_create(to_create)
+                if to_update:
+                    Product.objects.bulk_update(to_update, sorted(fields))
+        except IntegrityError:
+            # Another import created one of these SKUs concurrently
+            for product in to_create + to_update:
+                self.add_error(rows[product.sku][0], product.sku, {'sku': ["Conflicting concurrent write, retry this row."]})
+            return
+
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        product_ids = [product.pk for product in to_update]
+        if created and created[0].pk is not None:
+            product_ids += [product.pk for product in created]
+        else:
+            product_ids += list(Product.objects.filter(sku__in=[product.sku for product in to_create]).values_list('pk', flat=True))
+        self.invalidate(product_ids)
+
+    def invalidate(self, product_ids):
+        if not product_ids:
+            return
+        bump_catalog_version()
+        # In-process search and suggestion indexes rebuild on the next query
+        bump_search_version()
+        refresh_effective_prices(product_ids)
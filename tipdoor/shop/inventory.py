@@ -0,0 +1,110 @@
+"""
+Stock reservation for checkout.
+
+Checkout takes stock with one guarded UPDATE (`stock >= requested` for every
+product), after locking the product rows in id order so that concurrent
+checkouts of overlapping carts cannot deadlock. Cancelling an order returns
+its stock exactly once, guarded by a conditional status update.
+
+Both advance the products' updated_at but leave the catalog epoch alone, so
+only responses showing those products are revalidated (see shop.cache).
+"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+
+CANCELLED = 'CANCELLED'
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortfalls):
+        # {product id: units still available}
+        self.shortfalls = shortfalls
+        super().__init__("Insufficient stock")
+
+
+def line_quantities(lines):
+    """Sums (product id, quantity) pairs per product"""
+    quantities = defaultdict(int)
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity
+    return dict(quantities)
+
+
+def _per_product(quantities):
+    return Case(*[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()])
+
+
+def _shortfalls(quantities, available):
+    return {
+        product_id: available.get(product_id, 0)
+        for product_id, quantity in quantities.items()
+        if available.get(product_id, 0) < quantity
+    }
+
+
+def reserve_stock(quantities):
+    """
+    Takes {product id: units} out of stock, all or nothing, or raises
+    InsufficientStock. Must run inside the checkout transaction, which has to
+    roll back when this raises.
+    """
+    if not quantities:
+        return
+
+    # FOR UPDATE in id order; ignored on SQLite, which serializes writers anyway
+    available = dict(
+        Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', 'stock')
+    )
+    shortfalls = _shortfalls(quantities, available)
+    if shortfalls:
+        raise InsufficientStock(shortfalls)
+
+    # The per-product guards keep the update correct even where rows are not locked
+    guard = Q()
+    for product_id, quantity in quantities.items():
+        guard |= Q(pk=product_id, stock__gte=quantity)
+    updated = Product.objects.filter(guard).update(
+        stock=F('stock') - _per_product(quantities),
+        updated_at=timezone.now()
+    )
+    if updated != len(quantities):
+        available = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+        raise InsufficientStock(_shortfalls(quantities, available))
+
+
+def release_stock(quantities):
+    """Puts {product id: units} back into stock"""
+    if not quantities:
+        return
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F('stock') + _per_product(quantities),
+        updated_at=timezone.now()
+    )
+
+
+def cancel_order(order):
+    """Cancels `order` and releases its stock. Returns False if it was already cancelled."""
+    with transaction.atomic():
+        cancelled = Order.objects.filter(pk=order.pk).exclude(status=CANCELLED).update(status=CANCELLED)
+        if not cancelled:
+            return False
+        release_stock(line_quantities(OrderItem.objects.filter(order_id=order.pk).values_list('product_id', 'quantity')))
+    order.status = CANCELLED
+    return True
+
+
+def update_order_status(order, new_status):
+    """Moves `order` to `new_status` unless it has been cancelled. Returns whether it changed."""
+    if new_status == CANCELLED:
+        return cancel_order(order)
+    # Stock of a cancelled order is already released, so it cannot be reopened
+    updated = Order.objects.filter(pk=order.pk).exclude(status=CANCELLED).update(status=new_status)
+    if updated:
+        order.status = new_status
+    return bool(updated)
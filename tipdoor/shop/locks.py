@@ -0,0 +1,26 @@
+"""
+Short locks held in a shared cache.
+
+A lock is a cache entry created with add(), so it is exactly as atomic as
+the backend's add(): Redis, Memcached and the database cache are, the file
+cache nearly so. The entry expires after `timeout` seconds, so a process
+that dies holding a lock cannot block the others for longer than that.
+"""
+
+import contextlib
+import time
+import uuid
+
+
+@contextlib.contextmanager
+def cache_lock(cache, name, timeout=5, poll=0.005):
+    key = f'lock:{name}'
+    token = uuid.uuid4().hex
+    while not cache.add(key, token, timeout):
+        time.sleep(poll)
+    try:
+        yield
+    finally:
+        # Only release our own lock, not one taken after ours expired
+        if cache.get(key) == token:
+            cache.delete(key)
@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from shop.models import Product
+
+
+def percentile(timings, fraction):
+    """Milliseconds at `fraction` of the sorted timings"""
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000
+
+
+class SessionWriteCounter:
+    """Database execute wrapper counting statements that write django_session"""
+
+    def __init__(self):
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        statement = sql.lstrip()[:6].upper()
+        if 'django_session' in sql and statement in ('INSERT', 'UPDATE', 'DELETE'):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays guest add-to-cart traffic in process against each session "
+        "backend and reports latency percentiles and django_session writes. "
+        "Run it against a staging database: the db backends write real rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', action='append', choices=list(settings.SESSION_ENGINES), help="Backend to measure; repeatable (default: all)")
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--visitors', type=int, default=50, help="Distinct guests the requests are spread over")
+        parser.add_argument('--product', type=int, help="Product to add (default: the first published one)")
+
+    def handle(self, *args, **options):
+        product_id = options['product'] or Product.objects.filter(is_published=True).values_list('pk', flat=True).first()
+        if product_id is None:
+            raise CommandError("No published product to add to carts")
+
+        self.stdout.write(f"{options['requests']} requests from {options['visitors']} guests, current backend: {settings.SESSION_BACKEND}")
+        for backend in options['backend'] or settings.SESSION_ENGINES:
+            # The test client sends requests to "testserver"
+            with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[backend], ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                timings, writes = self.run(product_id, options['requests'], options['visitors'])
+            timings.sort()
+            self.stdout.write(
+                f"{backend:>15}: p50 {percentile(timings, 0.5):.1f}ms  p99 {percentile(timings, 0.99):.1f}ms  "
+                f"mean {statistics.mean(timings) * 1000:.1f}ms  django_session writes {writes}"
+            )
+
+    def run(self, product_id, requests, visitors):
+        # Secure cookies are still sent back by the test client over plain http
+        clients = [Client() for _ in range(visitors)]
+        counter = SessionWriteCounter()
+        timings = []
+        with connection.execute_wrapper(counter):
+            for i in range(requests):
+                client = clients[i % visitors]
+                started = time.perf_counter()
+                response = client.post('/api/cart/add/', {'product_id': product_id, 'quantity': 1}, content_type='application/json')
+                timings.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    raise CommandError(f"Cart add failed with {response.status_code}: {response.content[:200]!r}")
+        return timings, counter.writes
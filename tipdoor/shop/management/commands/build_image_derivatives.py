@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.images import generate_derivatives, needs_derivatives
+from shop.models import Product, Promotion
+
+
+class Command(BaseCommand):
+    help = "Builds missing or outdated image derivatives for products and promotions"
+
+    def handle(self, *args, **options):
+        targets = [
+            (Product, 'image', 'image_variants', settings.IMAGE_DERIVATIVE_WIDTHS['product']),
+            (Promotion, 'banner_image', 'banner_variants', settings.IMAGE_DERIVATIVE_WIDTHS['promotion']),
+        ]
+        for model, field_name, variants_field, widths in targets:
+            built = 0
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for instance in queryset.only('pk', field_name, variants_field).iterator():
+                if needs_derivatives(instance, field_name, variants_field):
+                    generate_derivatives(model, instance.pk, field_name, variants_field, widths)
+                    built += 1
+            self.stdout.write(f"{model.__name__}: built derivatives for {built} images")
@@ -0,0 +1,38 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.importers import FORMATS, ProductImporter, detect_format
+from vendors.models import Vendor
+
+
+class Command(BaseCommand):
+    help = "Creates or updates a vendor's products from a CSV or JSON-lines file keyed by sku."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--vendor', type=int, required=True, help="Vendor id owning the products")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, help="Rows per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            vendor = Vendor.objects.get(pk=options['vendor'])
+        except Vendor.DoesNotExist:
+            raise CommandError(f"Vendor {options['vendor']} does not exist")
+
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError("Could not detect the file format, pass --format")
+
+        importer = ProductImporter(vendor, chunk_size=options['chunk_size'])
+        if options['path'] == '-':
+            report = importer.run(sys.stdin.buffer, file_format)
+        else:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(stream, file_format)
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']} ({error['sku']}): {json.dumps(error['errors'])}")
+        self.stdout.write(f"Created {report['created']}, updated {report['updated']}, failed {report['failed']}")
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from shop.cache import bump_catalog_version
+from shop.models import Product
+from shop.promotions import refresh_effective_prices
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes effective prices whose promotion window opened or closed. "
+        "Use --all to rebuild every product, --loop to keep sweeping."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Refresh every product, not only stale ones")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping until interrupted")
+        parser.add_argument('--interval', type=float, default=30, help="Seconds between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            refreshed = self.sweep(options['all'], options['batch_size'])
+            if refreshed:
+                bump_catalog_version()
+            self.stdout.write(f"Refreshed {refreshed} effective prices")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def sweep(self, refresh_all, batch_size):
+        now = timezone.now()
+        products = Product.objects.order_by('pk')
+        if not refresh_all:
+            products = products.filter(
+                Q(effective_price__isnull=True) | Q(effective_price__valid_until__lte=now)
+            )
+
+        refreshed = 0
+        last_pk = 0
+        while True:
+            product_ids = list(products.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not product_ids:
+                return refreshed
+            refreshed += refresh_effective_prices(product_ids, now=now)
+            last_pk = product_ids[-1]
@@ -0,0 +1,36 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Delivers transactional outbox messages. Runs until interrupted; "
+        "several workers can run at once. Use --once to drain a single batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to wait when no message is due")
+        parser.add_argument('--once', action='store_true', help="Process one batch and exit")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Finish the current batch on SIGTERM instead of abandoning its leases
+        signal.signal(signal.SIGTERM, self.stop)
+
+        while not self.stopping:
+            delivered, retried, dead = process_batch(options['batch_size'])
+            if delivered or retried or dead:
+                self.stdout.write(f"Delivered {delivered}, retrying {retried}, dead {dead}")
+            if options['once']:
+                break
+            if not (delivered or retried or dead):
+                time.sleep(options['interval'])
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_otp'),
+        ('vendors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='shop_order_user_id_7c9c17_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_published', 'created_at', 'id'], name='shop_produc_is_publ_3e1f5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['vendor', 'created_at', 'id'], name='shop_produc_vendor__8c24ad_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:45
+
+from django.db import migrations
+
+
+def create_search_indexes(apps, schema_editor):
+    # Full-text and trigram indexes only exist on PostgreSQL; other
+    # databases fall back to the in-process index in shop.search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS shop_product_search_idx ON shop_product "
+        "USING gin (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(sku, '')))"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS shop_product_name_trgm_idx ON shop_product "
+        "USING gin (name gin_trgm_ops)"
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS shop_product_name_trgm_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS shop_product_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
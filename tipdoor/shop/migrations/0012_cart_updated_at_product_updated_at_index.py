@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_published', 'updated_at'], name='shop_produc_is_publ_319cbe_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_cart_updated_at_product_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='banner_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
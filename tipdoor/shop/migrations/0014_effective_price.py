@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePrice',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='effective_price', serialize=False, to='shop.product')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discounted_price', models.DecimalField(db_index=True, decimal_places=2, max_digits=10)),
+                ('valid_until', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('promotion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.promotion')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_effective_price'),
+        ('vendors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_published', 'price', 'id'], name='shop_produc_is_publ_dc3677_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_published', 'stock'], name='shop_produc_is_publ_68bea7_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:49
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Folds repeated (cart, product) lines into the oldest one, summing quantities"""
+    CartItem = apps.get_model('shop', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        lines = CartItem.objects.filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id'])
+        lines.filter(id=duplicate['keep']).update(quantity=duplicate['total'])
+        lines.exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
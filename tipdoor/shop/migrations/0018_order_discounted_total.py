@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:58
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_discounted_totals(apps, schema_editor):
+    """Sums the stored line prices of existing orders, discounted where a discount applied"""
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    money = DecimalField(max_digits=10, decimal_places=2)
+    line_totals = (
+        OrderItem.objects.filter(order_id=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum(ExpressionWrapper(Coalesce('discounted_price', 'price') * F('quantity'), output_field=money)))
+        .values('total')
+    )
+    Order.objects.filter(discounted_total__isnull=True).update(
+        discounted_total=Coalesce(Subquery(line_totals, output_field=money), F('total_amount'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_cart_item_unique_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_discounted_totals, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
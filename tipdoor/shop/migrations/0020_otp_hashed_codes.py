@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def delete_codes(apps, schema_editor):
+    # Stored in clear and valid for minutes only; users just request a new one
+    apps.get_model('shop', 'OTP').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_outbox_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_codes, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='otp',
+            options={},
+        ),
+        migrations.RemoveIndex(
+            model_name='otp',
+            name='shop_otp_mobile__0cebe9_idx',
+        ),
+        migrations.RemoveField(
+            model_name='otp',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='otp',
+            name='is_verified',
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='mobile_number',
+            field=models.CharField(max_length=15),
+        ),
+        migrations.AddField(
+            model_name='otp',
+            name='code_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='otp',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['mobile_number', 'code_hash', 'expires_at'], name='shop_otp_mobile__1b8ded_idx'),
+        ),
+    ]
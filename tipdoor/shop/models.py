@@ -1,5 +1,3 @@
-from datetime import timedelta
-
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -7,6 +5,8 @@ from django.utils import timezone
 
 from vendors.models import Vendor
 
+LOW_STOCK_THRESHOLD = 5
+
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='customer')
     name = models.CharField(max_length=100, blank=True)
@@ -19,34 +19,45 @@ class Customer(models.Model):
         return f"{self.name or 'User'} - {self.mobile_number}"
 
 class OTP(models.Model):
-    mobile_number = models.CharField(max_length=15, db_index=True)
-    otp = models.CharField(max_length=6)
+    """A one-time code of the database OTP store; see shop.otp"""
+
+    mobile_number = models.CharField(max_length=15)
+    # HMAC of the code, never the code itself
+    code_hash = models.CharField(max_length=64)
     created_at = models.DateTimeField(auto_now_add=True)
-    is_verified = models.BooleanField(default=False)
+    expires_at = models.DateTimeField(db_index=True)
 
     class Meta:
-        ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['mobile_number', '-created_at']),
+            models.Index(fields=['mobile_number', 'code_hash', 'expires_at']),
         ]
 
-    def is_valid(self):
-        """Check if OTP is still valid (5 minutes)"""
-        return self.created_at >= timezone.now() - timedelta(minutes=5)
-
     def __str__(self):
-        return f"{self.mobile_number} - {self.otp}"
+        return f"{self.mobile_number} (expires {self.expires_at})"
 
 class Product(models.Model):
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='products')
     name = models.CharField(max_length=200)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     sku = models.CharField(max_length=50, unique=True)
     stock = models.PositiveIntegerField(default=0)
     is_published = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) 
+
+    class Meta:
+        indexes = [
+            # Keyset pagination on (created_at, id) for the catalog and vendor listings
+            models.Index(fields=['is_published', 'created_at', 'id']),
+            models.Index(fields=['vendor', 'created_at', 'id']),
+            # Max(updated_at) validator for conditional GETs on the catalog
+            models.Index(fields=['is_published', 'updated_at']),
+            # Price and stock filters/sorting on the catalog
+            models.Index(fields=['is_published', 'price', 'id']),
+            models.Index(fields=['is_published', 'stock']),
+        ]
     
     def __str__(self):
         return self.name
@@ -55,7 +66,7 @@ class Product(models.Model):
     def status(self):
         if self.stock == 0:
             return "Out of Stock"
-        elif self.stock <= 5:  # threshold for low stock
+        elif self.stock <= LOW_STOCK_THRESHOLD:
             return "Low Stock"
         return "In Stock"
 
@@ -63,6 +74,7 @@ class Cart(models.Model):
     customer = models.ForeignKey(Customer, null=True, blank=True, on_delete=models.CASCADE, related_name='cart')
     session_key = models.CharField(max_length=40, null=True, blank=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         if self.customer:
@@ -74,6 +86,12 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # One line per product, so cart changes can be written as upserts
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in cart"
 
@@ -92,9 +110,16 @@ class Order(models.Model):
     postal_code = models.CharField(max_length=20)
     country = models.CharField(max_length=100)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Total after the promo code, fixed at checkout
+    discounted_total = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
     promo_code = models.CharField(max_length=50, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.name}"
 
@@ -127,6 +152,7 @@ class Promotion(models.Model):
     )
     applicable_products = models.ManyToManyField(Product, related_name='promotions')
     banner_image = models.ImageField(upload_to='promotions/', blank=True, null=True)
+    banner_variants = models.JSONField(default=dict, blank=True, editable=False)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -142,3 +168,79 @@ class Promotion(models.Model):
                 name='end_date_after_start_date'
             )
         ]
+
+class EffectivePrice(models.Model):
+    """
+    Denormalized current price of a product: its best live promotion and the
+    resulting discounted price (equal to price when nothing applies). Rows are
+    refreshed when products or promotions change, and swept once
+    `valid_until`, the next promotion start or end, has passed.
+    """
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='effective_price')
+    promotion = models.ForeignKey(Promotion, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    discounted_price = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
+    valid_until = models.DateTimeField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def is_current(self, now):
+        return self.valid_until is None or now < self.valid_until
+
+    def __str__(self):
+        return f"{self.product_id}: {self.discounted_price}"
+
+class IdempotencyKey(models.Model):
+    """
+    A client-chosen Idempotency-Key and the response it produced, so retried
+    requests are answered from here instead of being executed again.
+    """
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'key'], name='unique_idempotency_key_per_customer'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.customer_id})"
+
+class OutboxMessage(models.Model):
+    """
+    A side effect (notification, webhook, ...) recorded in the same
+    transaction as the change that caused it, and delivered later by the
+    run_outbox worker.
+    """
+
+    PENDING = 'PENDING'
+    DONE = 'DONE'
+    DEAD = 'DEAD'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead'),
+    ]
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Not delivered before this; pushed forward while claimed and after failures
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.id} ({self.status})"
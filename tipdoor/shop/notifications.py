@@ -0,0 +1,38 @@
+"""
+Outbox handlers for order notifications.
+
+An approved order fans out into one message per matching delivery partner,
+so a partner whose notification keeps failing is retried on its own.
+"""
+
+from delivery.models import DeliveryPartner
+
+from .models import Order, OutboxMessage
+
+
+def send_notification(partner, order):
+    print("Send notification function")
+
+
+def notify_delivery_partners(payload):
+    """order.approved: queues a notification for every available partner serving the order's address"""
+    order = Order.objects.filter(pk=payload['order_id']).only('address').first()
+    if order is None:
+        return
+    partner_ids = DeliveryPartner.objects.filter(
+        is_available=True,
+        service_area__contains=order.address
+    ).values_list('pk', flat=True)
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(topic='delivery.notify', payload={'order_id': order.pk, 'partner_id': partner_id})
+        for partner_id in partner_ids
+    ])
+
+
+def notify_delivery_partner(payload):
+    """delivery.notify: tells one partner about an approved order"""
+    partner = DeliveryPartner.objects.filter(pk=payload['partner_id']).first()
+    order = Order.objects.filter(pk=payload['order_id']).first()
+    if partner is None or order is None:
+        return
+    send_notification(partner, order)
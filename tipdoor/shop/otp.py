@@ -0,0 +1,97 @@
+"""
+One-time login codes.
+
+Codes are stored as an HMAC of the mobile number and code, so a leaked store
+does not reveal live codes, and expire OTP_TTL seconds after they are issued.
+OTP_STORE selects where they are kept: "cache" keeps them in a shared cache
+that evicts them on expiry, "database" in the OTP table with the expiry in
+the indexed lookup (expired rows are removed by purge_stale_data).
+
+Verification consumes a code with one delete, so a code can be used once
+even by concurrent requests.
+"""
+
+import hashlib
+import hmac
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import OTP
+
+
+def normalize_mobile_number(value):
+    """
+    The 10-digit mobile number in `value`, or None. Surrounding whitespace is
+    dropped as serializer CharFields do, so every spelling the API accepts
+    maps to one number.
+    """
+    value = str(value).strip()
+    return value if len(value) == 10 and value.isascii() and value.isdigit() else None
+
+
+def generate_code():
+    return f'{secrets.randbelow(10 ** 6):06d}'
+
+
+def hash_code(mobile_number, code):
+    message = f'{mobile_number}:{code}'.encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+class CacheOTPStore:
+    """Codes as cache entries that expire with their TTL"""
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    def key(self, mobile_number, code):
+        return f'otp:{hash_code(mobile_number, code)}'
+
+    def issue(self, mobile_number, code):
+        caches[self.alias].set(self.key(mobile_number, code), 1, self.ttl)
+
+    def consume(self, mobile_number, code):
+        """True if the code was live; only one caller can get True for it"""
+        return caches[self.alias].delete(self.key(mobile_number, code))
+
+    def discard(self, mobile_number, code):
+        """Withdraws a code that was issued but could not be sent"""
+        caches[self.alias].delete(self.key(mobile_number, code))
+
+
+class DatabaseOTPStore:
+    """Codes as OTP rows"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def issue(self, mobile_number, code):
+        OTP.objects.create(
+            mobile_number=mobile_number,
+            code_hash=hash_code(mobile_number, code),
+            expires_at=timezone.now() + timedelta(seconds=self.ttl)
+        )
+
+    def consume(self, mobile_number, code):
+        """True if the code was live; only one caller can get True for it"""
+        deleted, _ = OTP.objects.filter(
+            mobile_number=mobile_number,
+            code_hash=hash_code(mobile_number, code),
+            expires_at__gt=timezone.now()
+        ).delete()
+        return bool(deleted)
+
+    def discard(self, mobile_number, code):
+        """Withdraws a code that was issued but could not be sent"""
+        OTP.objects.filter(mobile_number=mobile_number, code_hash=hash_code(mobile_number, code)).delete()
+
+
+def get_otp_store():
+    if settings.OTP_STORE == 'cache':
+        return CacheOTPStore(settings.OTP_CACHE, settings.OTP_TTL)
+    return DatabaseOTPStore(settings.OTP_TTL)
@@ -0,0 +1,112 @@
+"""
+Transactional outbox.
+
+Side effects of a write are recorded as OutboxMessage rows in the same
+transaction as the write, so they are kept exactly when the write commits,
+and the request does not wait on the transport. The run_outbox worker
+claims due messages with SELECT ... FOR UPDATE SKIP LOCKED, so several
+workers can run side by side, and hides them for OUTBOX_LEASE while they
+are delivered. Failed messages are retried with exponential backoff and
+dead-lettered after OUTBOX_MAX_ATTEMPTS. A handler's own database writes
+commit with the message's acknowledgement; anything it sends elsewhere is
+delivered at least once.
+"""
+
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(topic, payload):
+    """Records a message; call it inside the transaction that makes the change"""
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def get_handler(topic):
+    path = settings.OUTBOX_HANDLERS.get(topic)
+    return import_string(path) if path else None
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt: doubling from OUTBOX_RETRY_BASE, capped, with jitter"""
+    delay = min(settings.OUTBOX_RETRY_BASE * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(batch_size, now=None):
+    """Takes up to `batch_size` due messages, oldest first, and leases them to this worker"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxMessage.PENDING, available_at__lte=now)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        if messages:
+            # A worker that dies mid-batch leaves its messages to reappear after the lease
+            OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+                attempts=F('attempts') + 1,
+                available_at=now + timedelta(seconds=settings.OUTBOX_LEASE)
+            )
+    for message in messages:
+        message.attempts += 1
+    return messages
+
+
+def fail(message, error, now=None):
+    """Schedules a retry of `message`, or dead-letters it once it is out of attempts"""
+    now = now or timezone.now()
+    if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        message.status = OutboxMessage.DEAD
+        logger.error("Outbox message %s (%s) dead after %s attempts: %s", message.pk, message.topic, message.attempts, error)
+    else:
+        message.available_at = now + timedelta(seconds=retry_delay(message.attempts))
+    message.last_error = error
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        status=message.status,
+        available_at=message.available_at,
+        last_error=error
+    )
+    return message.status
+
+
+def process_batch(batch_size=None):
+    """Delivers one batch of due messages. Returns (delivered, retried, dead) counts."""
+    messages = claim(batch_size or settings.OUTBOX_BATCH_SIZE)
+    delivered = retried = dead = 0
+    for message in messages:
+        handler = get_handler(message.topic)
+        if handler is None:
+            # Retrying cannot help a message nobody handles
+            message.attempts = settings.OUTBOX_MAX_ATTEMPTS
+            fail(message, f"No handler for topic {message.topic!r}")
+            dead += 1
+            continue
+        try:
+            with transaction.atomic():
+                handler(message.payload)
+                # Database writes of the handler commit together with the acknowledgement
+                OutboxMessage.objects.filter(pk=message.pk).update(
+                    status=OutboxMessage.DONE,
+                    processed_at=timezone.now(),
+                    last_error=''
+                )
+        except Exception as e:
+            logger.warning("Outbox message %s (%s) failed: %s", message.pk, message.topic, e)
+            if fail(message, f"{type(e).__name__}: {e}") == OutboxMessage.DEAD:
+                dead += 1
+            else:
+                retried += 1
+        else:
+            delivered += 1
+    return delivered, retried, dead
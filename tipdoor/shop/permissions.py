@@ -1,5 +1,4 @@
 from rest_framework.permissions import BasePermission
-from vendors.models import Vendor
 
 class IsVendor(BasePermission):
     def has_permission(self, request, view):
@@ -8,4 +7,5 @@ class IsVendor(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # Only allow access to the vendor's own products
-        return obj.vendor == request.user.vendor
+        # Compares ids, so the object's vendor is not loaded
+        return obj.vendor_id == request.user.vendor.pk
@@ -0,0 +1,139 @@
+"""
+Checkout pricing.
+
+Prices a cart and an optional promo code in Decimal, rounded to the cent,
+in a single pass: the promotion and the cart products it applies to are
+looked up with one query each. Quotes are cached per cart version, promo
+code and catalog epoch, so the quote a client was shown is the one checkout
+charges, without computing it again.
+"""
+
+import hashlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache import get_catalog_epoch
+from .models import Cart, CartItem, Promotion
+from .promotions import CENT, discount_price
+
+
+class PricingError(Exception):
+    pass
+
+
+class QuoteLine:
+    def __init__(self, product_id, quantity, price, discounted_price=None):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.price = price
+        # None when no discount applies, as stored on OrderItem
+        self.discounted_price = discounted_price
+
+    @property
+    def unit_price(self):
+        return self.price if self.discounted_price is None else self.discounted_price
+
+    @property
+    def subtotal(self):
+        return self.price * self.quantity
+
+    @property
+    def total(self):
+        return self.unit_price * self.quantity
+
+
+class Quote:
+    def __init__(self, lines, promotion=None, applicable_ids=frozenset()):
+        self.lines = lines
+        self.promotion = promotion
+        self.applicable_ids = applicable_ids
+        self.subtotal = sum((line.subtotal for line in lines), Decimal('0')).quantize(CENT)
+        self.total = sum((line.total for line in lines), Decimal('0')).quantize(CENT)
+        self.discount = self.subtotal - self.total
+
+    @property
+    def promo_code(self):
+        return self.promotion.promo_code if self.promotion else None
+
+    def as_dict(self):
+        return {
+            'promo_code': self.promo_code,
+            'lines': [
+                {
+                    'product_id': line.product_id,
+                    'quantity': line.quantity,
+                    'price': str(line.price),
+                    'discounted_price': None if line.discounted_price is None else str(line.discounted_price),
+                    'total': str(line.total),
+                }
+                for line in self.lines
+            ],
+            'subtotal': str(self.subtotal),
+            'discount': str(self.discount),
+            'total': str(self.total),
+        }
+
+
+def price_lines(lines, promotion=None, applicable_ids=frozenset()):
+    """Prices (product id, quantity, unit price) lines with `promotion` on `applicable_ids`"""
+    quote_lines = []
+    for product_id, quantity, price in lines:
+        discounted_price = None
+        if promotion and product_id in applicable_ids:
+            discounted = discount_price(price, promotion)
+            if discounted != price:
+                discounted_price = discounted
+        quote_lines.append(QuoteLine(product_id, quantity, price, discounted_price))
+    return Quote(quote_lines, promotion, applicable_ids)
+
+
+def find_promotion(promo_code, now=None):
+    now = now or timezone.now()
+    promotion = Promotion.objects.filter(
+        promo_code=promo_code,
+        is_active=True,
+        start_date__lte=now,
+        end_date__gte=now
+    ).first()
+    if promotion is None:
+        raise PricingError('Invalid or inactive promo code')
+    return promotion
+
+
+def quote_items(items, promo_code=''):
+    """Prices loaded cart lines, raising PricingError for an unusable promo code"""
+    lines = [(item.product_id, item.quantity, item.product.price) for item in items]
+    if not lines or not promo_code:
+        return price_lines(lines)
+
+    promotion = find_promotion(promo_code)
+    applicable_ids = frozenset(promotion.applicable_products.filter(
+        id__in=[product_id for product_id, _, _ in lines]
+    ).values_list('id', flat=True))
+    if not applicable_ids:
+        raise PricingError('Promo code does not apply to any items in the cart')
+    return price_lines(lines, promotion, applicable_ids)
+
+
+def cart_version(cart):
+    # Cart.updated_at moves whenever a line is added, changed or removed
+    return f'{cart.pk or cart.token}:{cart.updated_at.timestamp()}'
+
+
+def get_cart_quote(cart, promo_code=''):
+    """Quote for `cart` and `promo_code`, served from the cache while neither the cart nor the catalog changed"""
+    digest = hashlib.md5((promo_code or '').encode()).hexdigest()
+    key = f'quote:{cart_version(cart)}:{digest}:{get_catalog_epoch()}'
+
+    quote = cache.get(key)
+    if quote is None:
+        if isinstance(cart, Cart):
+            items = CartItem.objects.filter(cart=cart).select_related('product')
+        else:
+            items = cart.items
+        quote = quote_items(items, promo_code)
+        cache.set(key, quote, settings.QUOTE_CACHE_TIMEOUT)
+    return quote
@@ -0,0 +1,140 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.utils import timezone
+
+from .models import EffectivePrice, Product, Promotion
+
+CENT = Decimal('0.01')
+
+
+def discount_price(price, promotion):
+    """Price after `promotion`, in Decimal rounded to the cent"""
+    if promotion.discount_type == 'percentage':
+        discounted = price * (1 - promotion.discount_value / 100)
+    elif promotion.discount_type == 'fixed':
+        discounted = max(Decimal('0'), price - promotion.discount_value)
+    else:
+        discounted = price
+    return discounted.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def best_promotion(price, promotions):
+    """Returns (promotion, discounted price) for the promotion giving the lowest price"""
+    best, best_price = None, price
+    for promotion in sorted(promotions, key=lambda promotion: promotion.pk):
+        discounted = discount_price(price, promotion)
+        if best is None or discounted < best_price:
+            best, best_price = promotion, discounted
+    return best, best_price
+
+
+class PromotionResolver:
+    """
+    Looks up the best active promotion for a batch of products.
+
+    Reads come from the denormalized EffectivePrice rows; products whose row
+    is missing or stale are resolved live with a single query. One resolver
+    is shared through the serializer context, so every product on a page, and
+    both the `promotion` and `discounted_price` fields, reuse the lookup.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self._resolved = {}
+
+    def prime(self, products):
+        missing = {product.pk: product for product in products if product.pk not in self._resolved}
+        if not missing:
+            return
+
+        rows = EffectivePrice.objects.filter(product_id__in=missing).select_related('promotion')
+        for row in rows:
+            product = missing[row.product_id]
+            if row.is_current(self.now) and row.price == product.price:
+                self._resolved[row.product_id] = (row.promotion, row.discounted_price)
+                del missing[row.product_id]
+
+        if missing:
+            promotions = active_promotions(missing, self.now)
+            for product_id, product in missing.items():
+                promotion, discounted = best_promotion(product.price, promotions[product_id])
+                self._resolved[product_id] = (promotion, discounted)
+
+    def get(self, product):
+        if product.pk not in self._resolved:
+            self.prime([product])
+        return self._resolved[product.pk][0]
+
+    def get_discounted_price(self, product):
+        if product.pk not in self._resolved:
+            self.prime([product])
+        return self._resolved[product.pk][1]
+
+
+def get_promotion_resolver(context):
+    """Returns the resolver stored in a serializer context, creating it on first use"""
+    resolver = context.get('promotion_resolver')
+    if resolver is None:
+        resolver = context['promotion_resolver'] = PromotionResolver(now=context.get('now'))
+    return resolver
+
+
+def active_promotions(product_ids, now):
+    """Maps each product id to its list of live promotions, in one query"""
+    promotions = defaultdict(list)
+    links = Promotion.applicable_products.through.objects.filter(
+        product_id__in=product_ids,
+        promotion__is_active=True,
+        promotion__start_date__lte=now,
+        promotion__end_date__gte=now
+    ).select_related('promotion')
+    for link in links:
+        promotions[link.product_id].append(link.promotion)
+    return promotions
+
+
+def refresh_effective_prices(product_ids, now=None):
+    """
+    Recomputes the EffectivePrice rows of `product_ids`. Each row remembers
+    the next promotion start or end affecting the product in `valid_until`,
+    which is when the sweep has to recompute it again.
+    """
+    now = now or timezone.now()
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+
+    current = defaultdict(list)
+    boundaries = defaultdict(list)
+    links = Promotion.applicable_products.through.objects.filter(
+        product_id__in=product_ids,
+        promotion__is_active=True,
+        promotion__end_date__gte=now
+    ).select_related('promotion')
+    for link in links:
+        promotion = link.promotion
+        if promotion.start_date <= now:
+            current[link.product_id].append(promotion)
+            boundaries[link.product_id].append(promotion.end_date)
+        else:
+            boundaries[link.product_id].append(promotion.start_date)
+
+    rows = []
+    for product_id, price in Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'):
+        promotion, discounted = best_promotion(price, current[product_id])
+        rows.append(EffectivePrice(
+            product_id=product_id,
+            promotion=promotion,
+            price=price,
+            discounted_price=discounted,
+            valid_until=min(boundaries[product_id], default=None),
+        ))
+
+    EffectivePrice.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['promotion', 'price', 'discounted_price', 'valid_until', 'updated_at'],
+    )
+    return len(rows)
@@ -0,0 +1,202 @@
+"""
+Token-bucket rate limiting.
+
+A bucket holds up to `capacity` tokens and refills continuously, reaching
+capacity again after `period` seconds; each request takes one token, which
+can be given back when the request turns out not to count. The
+buckets live in the RATELIMIT_CACHE alias, so every worker shares them: in
+Redis they are updated by one Lua script so concurrent workers cannot race,
+in other shared caches (file, database) under a short cache lock. Only with
+a per-process cache (locmem) does each process keep its own buckets in
+memory, which is only exact with a single worker.
+
+The throttles read their limits from RATE_LIMITS[view.throttle_scope] and
+run before the view, so a rejected request never reaches the database.
+"""
+
+import collections.abc
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+from .locks import cache_lock
+from .otp import normalize_mobile_number
+
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ttl)
+return tostring(wait)
+"""
+
+
+def take_token(state, now, capacity, period, cost=1):
+    """
+    Refills a (tokens, updated) bucket and takes `cost` tokens, or gives them
+    back when negative; returns (state, wait)
+    """
+    rate = capacity / period
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + max(0, now - updated) * rate)
+    wait = 0
+    if tokens >= cost:
+        tokens = min(capacity, tokens - cost)
+    else:
+        wait = (cost - tokens) / rate
+    return (tokens, now), wait
+
+
+class LocalBucketStore:
+    """Buckets in this process's memory, least recently used evicted first"""
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, period, cost=1):
+        """Takes a token; returns 0, or the seconds until one is available"""
+        with self.lock:
+            self.buckets[key], wait = take_token(self.buckets.pop(key, None), time.monotonic(), capacity, period, cost)
+            if len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class RedisBucketStore:
+    """Buckets in Redis, shared by every worker"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.scripts = {}
+
+    def take(self, key, capacity, period, cost=1):
+        key = self.cache.make_and_validate_key(f'ratelimit:{key}')
+        client = self.cache._cache.get_client(key, write=True)
+        script = self.scripts.get(id(client))
+        if script is None:
+            script = self.scripts[id(client)] = client.register_script(TAKE_SCRIPT)
+        # A full bucket carries no information, so it can expire once refilled
+        return float(script(keys=[key], args=[capacity, capacity / period, int(period * 1000), cost]))
+
+    def clear(self):
+        pass
+
+
+class CacheBucketStore:
+    """Buckets in any other shared cache, read and written under a cache lock"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def take(self, key, capacity, period, cost=1):
+        key = f'ratelimit:{key}'
+        with cache_lock(self.cache, key):
+            # Wall clock, as the workers do not share a monotonic one
+            state, wait = take_token(self.cache.get(key), time.time(), capacity, period, cost)
+            self.cache.set(key, state, math.ceil(period))
+        return wait
+
+    def clear(self):
+        pass
+
+
+_local_store = LocalBucketStore()
+
+
+def get_bucket_store():
+    cache = caches[settings.RATELIMIT_CACHE]
+    if isinstance(cache, RedisCache):
+        return RedisBucketStore(cache)
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return _local_store
+    return CacheBucketStore(cache)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits requests per key with RATE_LIMITS[view.throttle_scope][limit_name],
+    a (capacity, period in seconds) pair. Views without such a limit are not
+    throttled.
+    """
+
+    limit_name = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError
+
+    def get_bucket(self, request, view):
+        """(bucket key, capacity, period) for the request, or None if it is not limited"""
+        limit = settings.RATE_LIMITS.get(getattr(view, 'throttle_scope', None), {}).get(self.limit_name)
+        key = self.get_key(request, view)
+        if limit is None or not key:
+            return None
+        return (f'{view.throttle_scope}:{self.limit_name}:{key}', *limit)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        wait = get_bucket_store().take(*bucket)
+        if wait:
+            self.wait_seconds = wait
+            return False
+        return True
+
+    def refund(self, request, view):
+        """Gives back the token an allowed request took"""
+        bucket = self.get_bucket(request, view)
+        if bucket is not None:
+            get_bucket_store().take(*bucket, cost=-1)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ClientIPThrottle(TokenBucketThrottle):
+    limit_name = 'ip'
+
+    def get_key(self, request, view):
+        # Honours REST_FRAMEWORK['NUM_PROXIES'] behind a load balancer
+        return self.get_ident(request)
+
+
+class MobileNumberThrottle(TokenBucketThrottle):
+    limit_name = 'mobile_number'
+
+    def get_key(self, request, view):
+        # Read before validation, normalized as the serializer does so that
+        # spellings of one number share a bucket. Anything the serializer
+        # rejects, including a body that is not an object, is not limited here.
+        if not isinstance(request.data, collections.abc.Mapping):
+            return None
+        value = request.data.get('mobile_number')
+        return normalize_mobile_number(value) if value is not None else None
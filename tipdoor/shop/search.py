@@ -0,0 +1,256 @@
+"""
+Product search.
+
+PostgreSQL uses a GIN full-text index on name and SKU plus a trigram index on
+name for typo tolerance. Other databases (SQLite in development) use an
+in-process inverted index with the same ranking behaviour. Normalized
+queries are cached as ranked product id lists and invalidated whenever a
+Product is saved or deleted.
+"""
+
+import bisect
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.cache import cache, caches
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+SEARCH_VERSION_KEY = 'search:version'
+
+# Must match the expression of shop_product_search_idx (migration 0011)
+SEARCH_VECTOR_SQL = "to_tsvector('simple', coalesce(shop_product.name, '') || ' ' || coalesce(shop_product.sku, ''))"
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, giving up once it exceeds `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def get_search_version():
+    versions = caches[settings.VERSION_CACHE]
+    version = versions.get(SEARCH_VERSION_KEY)
+    if version is None:
+        versions.add(SEARCH_VERSION_KEY, 1, None)
+        version = versions.get(SEARCH_VERSION_KEY, 1)
+    return version
+
+
+def bump_search_version():
+    versions = caches[settings.VERSION_CACHE]
+    try:
+        return versions.incr(SEARCH_VERSION_KEY)
+    except ValueError:
+        versions.set(SEARCH_VERSION_KEY, 2, None)
+        return 2
+
+
+class PostgresSearchBackend:
+    def search(self, tokens, limit):
+        query = ' '.join(tokens)
+        # Prefix-match every term so results update while the user types
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        matches = RawSQL(f"{SEARCH_VECTOR_SQL} @@ to_tsquery('simple', %s)", (tsquery,), output_field=BooleanField())
+        rank = RawSQL(f"ts_rank({SEARCH_VECTOR_SQL}, to_tsquery('simple', %s))", (tsquery,), output_field=FloatField())
+
+        queryset = Product.objects.filter(is_published=True).filter(
+            Q(matches) | Q(name__trigram_word_similar=query)
+        ).annotate(
+            score=rank + TrigramWordSimilarity(query, 'name')
+        ).order_by('-score', '-id')
+
+        return list(queryset.values_list('id', flat=True)[:limit])
+
+
+class InMemorySearchBackend:
+    """
+    Inverted index over published product names and SKUs, kept per process.
+
+    Every query term must match a document term exactly, as a prefix, or
+    within a small edit distance (typos, found through shared trigrams);
+    documents are ranked by the summed weights.
+    """
+
+    EXACT_WEIGHT = 1.0
+    PREFIX_WEIGHT = 0.7
+    FUZZY_WEIGHT = 0.5
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self._documents = {}
+        self._postings = defaultdict(dict)
+        self._terms = []
+        self._trigrams = defaultdict(set)
+
+    def build(self, version):
+        with self._lock:
+            self._documents.clear()
+            self._postings.clear()
+            self._terms.clear()
+            self._trigrams.clear()
+            products = Product.objects.filter(is_published=True).values_list('id', 'name', 'sku')
+            for product_id, name, sku in products.iterator():
+                self._add(product_id, name, sku)
+            self.version = version
+
+    def update(self, product, version):
+        with self._lock:
+            if self.version is None:
+                return
+            # Another process changed the catalog since we last synced; rebuild lazily
+            if self.version != version - 1:
+                self.version = None
+                return
+            self._remove(product.pk)
+            if product.is_published:
+                self._add(product.pk, product.name, product.sku)
+            self.version = version
+
+    def remove(self, product_id, version):
+        with self._lock:
+            if self.version is None:
+                return
+            if self.version != version - 1:
+                self.version = None
+                return
+            self._remove(product_id)
+            self.version = version
+
+    def search(self, tokens, limit):
+        version = get_search_version()
+        with self._lock:
+            if self.version != version:
+                self.build(version)
+
+            scores = None
+            for token in tokens:
+                token_scores = self._match(token)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pk: score + token_scores[pk] for pk, score in scores.items() if pk in token_scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+    def _match(self, token):
+        weights = {}
+        start = bisect.bisect_left(self._terms, token)
+        for term in self._terms[start:]:
+            if not term.startswith(token):
+                break
+            weights[term] = self.EXACT_WEIGHT if term == token else self.PREFIX_WEIGHT
+
+        if len(token) >= 4:
+            limit = 1 if len(token) < 8 else 2
+            candidates = set().union(*(self._trigrams.get(gram, ()) for gram in trigrams(token)))
+            for term in candidates:
+                if term in weights:
+                    continue
+                distance = edit_distance(token, term, limit)
+                if distance <= limit:
+                    weights[term] = self.FUZZY_WEIGHT * (1 - distance / len(token))
+
+        scores = {}
+        for term, weight in weights.items():
+            for product_id, frequency in self._postings[term].items():
+                scores[product_id] = max(scores.get(product_id, 0), weight * frequency)
+        return scores
+
+    def _add(self, product_id, name, sku):
+        tokens = tokenize(name) + tokenize(sku)
+        self._documents[product_id] = tokens
+        for token in tokens:
+            postings = self._postings[token]
+            if not postings:
+                bisect.insort(self._terms, token)
+                for gram in trigrams(token):
+                    self._trigrams[gram].add(token)
+            postings[product_id] = postings.get(product_id, 0) + 1
+
+    def _remove(self, product_id):
+        for token in set(self._documents.pop(product_id, ())):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._terms[bisect.bisect_left(self._terms, token)]
+                for gram in trigrams(token):
+                    self._trigrams[gram].discard(token)
+
+
+_in_memory_backend = InMemorySearchBackend()
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return _in_memory_backend
+
+
+def search_products(query):
+    """Returns ranked ids of published products matching `query`"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    normalized = ' '.join(tokens)
+    digest = hashlib.md5(normalized.encode()).hexdigest()
+    key = f'search:{get_search_version()}:{digest}'
+
+    product_ids = cache.get(key)
+    if product_ids is None:
+        product_ids = get_search_backend().search(tokens, settings.SEARCH_MAX_RESULTS)
+        cache.set(key, product_ids, settings.SEARCH_CACHE_TIMEOUT)
+    return product_ids
+
+
+def product_saved(product):
+    version = bump_search_version()
+    _in_memory_backend.update(product, version)
+    return version
+
+
+def product_deleted(product_id):
+    version = bump_search_version()
+    _in_memory_backend.remove(product_id, version)
+    return version
@@ -1,13 +1,30 @@
 from rest_framework import serializers
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.utils import timezone
+from django.db import models
+from django.db.models import Prefetch, prefetch_related_objects
 from .models import Product, Cart, CartItem, OrderItem, Order, Promotion, Vendor, Customer
+from .promotions import get_promotion_resolver
+from .images import image_srcset
+from .filters import PRODUCT_ORDERINGS, STOCK_STATUSES
+from .importers import FORMATS
+from .otp import normalize_mobile_number
+from .cart import cart_totals
+from .pricing import PricingError, find_promotion
+
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Resolve promotions for the whole page up front instead of per product
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        products = list(iterable)
+        get_promotion_resolver(self.context).prime(products)
+        return super().to_representation(products)
 
 class ProductSerializer(serializers.ModelSerializer):
     status = serializers.CharField(read_only=True)  # Derived from stock
     promotion = serializers.SerializerMethodField()
     discounted_price = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     def get_image(self, obj):
         if obj.image:
@@ -17,18 +34,13 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'sku', 'price', 'stock', 'status', 'image', 'is_published', 'created_at', 'updated_at', 'vendor', 'promotion', 'discounted_price']
-        read_only_fields = ['id', 'status', 'created_at', 'updated_at','vendor', 'promotion', 'discounted_price']
+        fields = ['id', 'name', 'sku', 'price', 'stock', 'status', 'image', 'image_srcset', 'is_published', 'created_at', 'updated_at', 'vendor', 'promotion', 'discounted_price']
+        read_only_fields = ['id', 'status', 'image_srcset', 'created_at', 'updated_at','vendor', 'promotion', 'discounted_price']
+        list_serializer_class = ProductListSerializer
 
     def get_promotion(self, obj):
         # Get active promotions for this product
-        now = timezone.now()
-        promotion = Promotion.objects.filter(
-            applicable_products__id=obj.id,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
+        promotion = get_promotion_resolver(self.context).get(obj)
         if promotion:
             return {
                 'title': promotion.title,
@@ -38,22 +50,44 @@ class ProductSerializer(serializers.ModelSerializer):
             }
         return None
 
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image_variants, self.context.get('request'))
+
     def get_discounted_price(self, obj):
-        now = timezone.now()
-        promotion = Promotion.objects.filter(
-            applicable_products__id=obj.id,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-        if promotion:
-            price = float(obj.price)
-            if promotion.discount_type == 'percentage':
-                return price * (1 - float(promotion.discount_value) / 100) 
-            elif promotion.discount_type == 'fixed':
-                return max(0, price - float(promotion.discount_value))
+        resolver = get_promotion_resolver(self.context)
+        if resolver.get(obj):
+            return float(resolver.get_discounted_price(obj))
         return None
 
+class ProductFilterSerializer(serializers.Serializer):
+    vendor = serializers.CharField(required=False, help_text="Comma-separated vendor ids")
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    stock = serializers.CharField(required=False, help_text="Comma-separated: in_stock, low_stock, out_of_stock")
+    on_promotion = serializers.BooleanField(required=False, allow_null=True)
+    sort = serializers.ChoiceField(choices=list(PRODUCT_ORDERINGS), default='newest')
+
+    def validate_vendor(self, value):
+        try:
+            return [int(vendor_id) for vendor_id in value.split(',') if vendor_id]
+        except ValueError:
+            raise serializers.ValidationError("Vendor must be a comma-separated list of ids")
+
+    def validate_stock(self, value):
+        statuses = [stock_status for stock_status in value.split(',') if stock_status]
+        if not set(statuses) <= set(STOCK_STATUSES):
+            raise serializers.ValidationError(f"Stock must be one of {', '.join(STOCK_STATUSES)}")
+        return statuses
+
+    def validate(self, data):
+        if data.get('min_price') is not None and data.get('max_price') is not None and data['min_price'] > data['max_price']:
+            raise serializers.ValidationError("min_price cannot exceed max_price")
+        return data
+
+class ProductImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=FORMATS, required=False)
+
 class CustomerSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
 
@@ -83,18 +117,26 @@ class CustomerRegistrationSerializer(serializers.ModelSerializer):
         customer = Customer.objects.create(user=user, **validated_data)
         return customer
 
+def validate_mobile_number(value):
+    # The same normalization MobileNumberThrottle keys its buckets on
+    mobile_number = normalize_mobile_number(value)
+    if mobile_number is None:
+        raise serializers.ValidationError("Mobile number must be 10 digits")
+    return mobile_number
+
 class SendOTPSerializer(serializers.Serializer):
     mobile_number = serializers.CharField(max_length=15)
 
     def validate_mobile_number(self, value):
-        if not value.isdigit() or len(value) != 10:
-            raise serializers.ValidationError("Mobile number must be 10 digits")
-        return value
+        return validate_mobile_number(value)
 
 class VerifyOTPSerializer(serializers.Serializer):
     mobile_number = serializers.CharField(max_length=15)
     otp = serializers.CharField(max_length=6)
 
+    def validate_mobile_number(self, value):
+        return validate_mobile_number(value)
+
     def validate_otp(self, value):
         if not value.isdigit() or len(value) != 6:
             raise serializers.ValidationError("OTP must be 6 digits")
@@ -107,6 +149,20 @@ class AddToCartSerializer(serializers.Serializer):
 class UpdateCartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1)
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, data):
+        if data['op'] != 'remove' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': "This field is required for add and set."})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=settings.CART_BATCH_MAX_OPERATIONS)
+    response = serializers.ChoiceField(choices=['full', 'delta'], default='full')
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
@@ -124,12 +180,38 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'customer', 'created_at', 'items']
 
+    def to_representation(self, instance):
+        # Load every line with its product once and resolve their promotions together
+        if isinstance(instance, Cart):
+            prefetch_related_objects([instance], Prefetch('items', queryset=CartItem.objects.select_related('product')))
+            items = instance.items.all()
+        else:
+            # Guest cart lines are built in memory, with their products loaded once
+            items = instance.items
+        get_promotion_resolver(self.context).prime([item.product for item in items])
+        return super().to_representation(instance)
+
+def serialize_cart_delta(cart, changed_product_ids, removed_item_ids, context):
+    """Only the changed lines of `cart`, the removed line ids and the new totals"""
+    if isinstance(cart, Cart):
+        items = list(CartItem.objects.filter(cart=cart).select_related('product'))
+    else:
+        items = cart.items
+    resolver = get_promotion_resolver(context)
+    resolver.prime([item.product for item in items])
+    changed = [item for item in items if item.product_id in changed_product_ids]
+    return {
+        'items': CartItemSerializer(changed, many=True, context=context).data,
+        'removed': removed_item_ids,
+        'totals': cart_totals(items, resolver),
+    }
+
 class OrderItemSerializer(serializers.ModelSerializer):
     order_id = serializers.IntegerField(source='order.id', read_only=True)
     order_date = serializers.DateTimeField(source='order.created_at', read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_sku = serializers.CharField(source='product.sku', read_only=True)
-    customer_name = serializers.CharField(source='order.user.get_full_name', read_only=True)
+    customer_name = serializers.CharField(source='order.user.name', read_only=True)
     order_status = serializers.CharField(source='order.status', read_only=True)
     discounted_price = serializers.SerializerMethodField()
 
@@ -139,24 +221,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'order_id', 'order_date', 'product_name', 'product_sku', 'customer_name', 'order_status', 'discounted_price']
 
     def get_discounted_price(self, obj):
-        promo_code = self.context.get('promo_code')
-        if not promo_code:
+        # Stored at checkout; None when no discount applied to the line
+        if obj.discounted_price is None:
             return None
-        now = timezone.now()
-        promotion = Promotion.objects.filter(
-            promo_code=promo_code,
-            applicable_products=obj.product,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-        if promotion:
-            price = float(obj.price)
-            if promotion.discount_type == 'percentage':
-                return price * (1 - float(promotion.discount_value) / 100)
-            elif promotion.discount_type == 'fixed':
-                return max(0, price - float(promotion.discount_value))
-        return None
+        return float(obj.discounted_price)
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
@@ -174,51 +242,21 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'created_at', 'status', 'items', 'total', 'discounted_total']
 
     def get_total(self, obj):
-        return sum(item.price * item.quantity for item in obj.items.all())
+        return obj.total_amount
 
     def get_discounted_total(self, obj):
-        promo_code = self.context.get('promo_code')
-        if not promo_code:
-            return self.get_total(obj)
-        total = 0
-        now = timezone.now()
-        for item in obj.items.all():
-            promotion = Promotion.objects.filter(
-                promo_code=promo_code,
-                applicable_products=item.product,
-                is_active=True,
-                start_date__lte=now,
-                end_date__gte=now
-            ).first()
-            if promotion:
-                price = float(item.price)
-                discounted_price = (price * (1 - float(promotion.discount_value) / 100) if promotion.discount_type == 'percentage'
-                                   else max(0, price - float(promotion.discount_value)))
-                total += discounted_price * item.quantity
-            else:
-                total += item.price * item.quantity
-        return total
+        return obj.discounted_total
 
     def validate_promo_code(self, value):
         if not value:
             return value
-        now = timezone.now()
-        promotion = Promotion.objects.filter(
-            promo_code=value,
-            is_active=True,
-            start_date__lte=now,
-            end_date__gte=now
-        ).first()
-        if not promotion:
-            raise serializers.ValidationError("Invalid or inactive promo code.")
-        # Check if promo_code applies to any cart items
+        # Check that the promo code is live and applies to some cart item
         cart_items = self.context.get('cart_items', [])
-        applicable = False
-        for item in cart_items:
-            if promotion.applicable_products.filter(id=item['product']).exists():
-                applicable = True
-                break
-        if not applicable:
+        try:
+            promotion = find_promotion(value)
+        except PricingError:
+            raise serializers.ValidationError("Invalid or inactive promo code.")
+        if not promotion.applicable_products.filter(id__in=[item['product'] for item in cart_items]).exists():
             raise serializers.ValidationError("Promo code does not apply to any items in the cart.")
         return value
 
@@ -231,15 +269,19 @@ class PromotionSerializer(serializers.ModelSerializer):
         many=True,
         required=False
     )
+    banner_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Promotion
         fields = [
             'id', 'title', 'description', 'start_date', 'end_date', 'promo_code',
             'discount_type', 'discount_value', 'applicable_products', 'banner_image',
-            'is_active', 'created_at', 'updated_at', 'vendor'
+            'banner_srcset', 'is_active', 'created_at', 'updated_at', 'vendor'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'vendor']
+        read_only_fields = ['id', 'banner_srcset', 'created_at', 'updated_at', 'vendor']
+
+    def get_banner_srcset(self, obj):
+        return image_srcset(obj.banner_variants, self.context.get('request'))
 
     def get_banner_image(self, obj):
         if obj.banner_image:
@@ -0,0 +1,31 @@
+"""
+Session engines that keep guest sessions out of the database.
+
+SESSION_BACKEND picks the engine (see settings). The "cache" and
+"signed_cookies" engines here are Django's, plus a migration path: a
+session that is not found is looked up once in SESSION_LEGACY_ENGINE (the
+database store used before) and, if it exists there, saved into the new
+store, so visitors keep their session and guest cart across the switch.
+Set SESSION_LEGACY_ENGINE to None once SESSION_COOKIE_AGE has passed.
+"""
+
+from importlib import import_module
+
+from django.conf import settings
+
+
+class LegacySessionMixin:
+    def load(self):
+        session_key = self.session_key
+        data = super().load()
+        if data or not self.is_legacy_key(session_key) or not settings.SESSION_LEGACY_ENGINE:
+            return data
+        data = import_module(settings.SESSION_LEGACY_ENGINE).SessionStore(session_key).load()
+        if data:
+            # Written to this store at the end of the request
+            self.modified = True
+        return data
+
+    def is_legacy_key(self, session_key):
+        # Database session keys are 32 lowercase letters and digits
+        return bool(session_key) and len(session_key) == 32 and session_key.isalnum()
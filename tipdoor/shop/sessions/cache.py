@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import cache
+
+from . import LegacySessionMixin
+
+
+class SessionStore(LegacySessionMixin, cache.SessionStore):
+    """Sessions in SESSION_CACHE_ALIAS, falling back to SESSION_LEGACY_ENGINE"""
@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import search, suggest
+from .images import needs_derivatives, schedule_derivatives
+from .cache import bump_catalog_version
+from .promotions import refresh_effective_prices
+from .models import Cart, CartItem, Customer, Product, Promotion
+from .authentication import forget_user
+from vendors.models import Vendor
+
+
+def index_product(product):
+    version = search.product_saved(product)
+    suggest.product_saved(product, version)
+
+
+def unindex_product(product_id):
+    version = search.product_deleted(product_id)
+    suggest.product_deleted(product_id, version)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_product(instance))
+    transaction.on_commit(bump_catalog_version)
+    transaction.on_commit(lambda: refresh_effective_prices([instance.pk]))
+    if needs_derivatives(instance, 'image', 'image_variants'):
+        widths = settings.IMAGE_DERIVATIVE_WIDTHS['product']
+        transaction.on_commit(lambda: schedule_derivatives(instance, 'image', 'image_variants', widths))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: unindex_product(product_id))
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver([post_save, post_delete], sender=Promotion)
+def promotion_changed(sender, instance, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(pre_delete, sender=Promotion)
+def promotion_deleting(sender, instance, **kwargs):
+    # The product links are gone by post_delete, so remember them now
+    product_ids = list(instance.applicable_products.values_list('id', flat=True))
+    transaction.on_commit(lambda: refresh_effective_prices(product_ids))
+
+
+@receiver(post_save, sender=Promotion)
+def promotion_saved(sender, instance, **kwargs):
+    if not kwargs.get('created'):
+        product_ids = list(instance.applicable_products.values_list('id', flat=True))
+        transaction.on_commit(lambda: refresh_effective_prices(product_ids))
+    if needs_derivatives(instance, 'banner_image', 'banner_variants'):
+        widths = settings.IMAGE_DERIVATIVE_WIDTHS['promotion']
+        transaction.on_commit(lambda: schedule_derivatives(instance, 'banner_image', 'banner_variants', widths))
+
+
+@receiver(m2m_changed, sender=Promotion.applicable_products.through)
+def promotion_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Like deletes, clears do not report which products were affected
+        if reverse:
+            instance._cleared_product_ids = [instance.pk]
+        else:
+            instance._cleared_product_ids = list(instance.applicable_products.values_list('id', flat=True))
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_catalog_version)
+
+        if action == 'post_clear':
+            product_ids = getattr(instance, '_cleared_product_ids', [])
+        elif reverse:
+            product_ids = [instance.pk]
+        else:
+            product_ids = list(pk_set or [])
+        transaction.on_commit(lambda: refresh_effective_prices(product_ids))
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def cart_item_changed(sender, instance, **kwargs):
+    # Cart.updated_at is the cart's validator for conditional GETs. A queryset
+    # delete (e.g. clearing the cart at checkout) touches each cart only once.
+    origin = kwargs.get('origin')
+    if isinstance(origin, Cart) or (isinstance(origin, QuerySet) and origin.model is Cart):
+        # The cart itself is being deleted
+        return
+    if isinstance(origin, QuerySet):
+        touched = origin.__dict__.setdefault('_touched_cart_ids', set())
+        if instance.cart_id in touched:
+            return
+        touched.add(instance.cart_id)
+    Cart.objects.filter(pk=instance.cart_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # After commit, so a concurrent request cannot cache the old row again
+    transaction.on_commit(lambda: forget_user(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Vendor)
+def profile_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_user(instance.user_id))
@@ -0,0 +1,188 @@
+"""
+Outgoing SMS.
+
+Messages are put on a bounded in-process queue and sent by a pool of
+SMS_WORKERS threads, so a slow or failing gateway never holds up a request.
+Each worker takes up to SMS_BATCH_SIZE queued messages, hands them to the
+SMS_BACKEND in one call with SMS_TIMEOUT, and retries a failed batch with
+backoff up to SMS_MAX_ATTEMPTS times. When the queue is full, send_sms
+raises SMSQueueFull instead of blocking.
+
+The queue lives in memory on purpose: OTP messages carry the code in clear,
+which must not be written to the database. Messages still queued when the
+process exits are given SMS_SHUTDOWN_TIMEOUT to be sent.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class SMSQueueFull(Exception):
+    pass
+
+
+class SMSMessage:
+    def __init__(self, to, body):
+        self.to = to
+        self.body = body
+
+    def as_dict(self):
+        return {'to': self.to, 'body': self.body}
+
+
+class BaseSMSBackend:
+    def __init__(self, timeout=None):
+        self.timeout = timeout or settings.SMS_TIMEOUT
+
+    def send_messages(self, messages):
+        """Sends a batch of SMSMessages; raises if the batch was not accepted"""
+        raise NotImplementedError
+
+
+class ConsoleBackend(BaseSMSBackend):
+    """Writes messages to stdout, for development"""
+
+    lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self.lock:
+            for message in messages:
+                sys.stdout.write(f"SMS to {message.to}: {message.body}\n")
+            sys.stdout.flush()
+
+
+class FileBackend(BaseSMSBackend):
+    """Appends messages as JSON lines to SMS_FILE_PATH"""
+
+    lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self.lock, open(settings.SMS_FILE_PATH, 'a', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps(message.as_dict()) + '\n')
+
+
+class HTTPBackend(BaseSMSBackend):
+    """POSTs each batch as JSON to SMS_HTTP_URL, e.g. a local gateway stub"""
+
+    def send_messages(self, messages):
+        request = urllib.request.Request(
+            settings.SMS_HTTP_URL,
+            data=json.dumps({'messages': [message.as_dict() for message in messages]}).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        # Raises for connection errors, timeouts and non-2xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class LocmemBackend(BaseSMSBackend):
+    """Keeps messages in LocmemBackend.outbox, for tests"""
+
+    outbox = []
+
+    def send_messages(self, messages):
+        self.outbox.extend(messages)
+
+
+def get_backend():
+    return import_string(settings.SMS_BACKEND)()
+
+
+class SMSDispatcher:
+    """The queue and its worker threads, started on first use in each process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.workers = []
+
+    def start(self):
+        with self.lock:
+            # A forked server worker does not inherit the parent's threads
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue(maxsize=settings.SMS_QUEUE_SIZE)
+            self.workers = [
+                threading.Thread(target=self.work, name=f'sms-worker-{i}', daemon=True)
+                for i in range(settings.SMS_WORKERS)
+            ]
+            for worker in self.workers:
+                worker.start()
+
+    def put(self, message):
+        self.start()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            raise SMSQueueFull("SMS queue is full") from None
+
+    def work(self):
+        backend = get_backend()
+        stopping = False
+        while not stopping:
+            message = self.queue.get()
+            if message is None:
+                return
+            batch = [message]
+            while len(batch) < settings.SMS_BATCH_SIZE:
+                try:
+                    message = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message is None:
+                    # Each worker takes one stop marker; send what it holds first
+                    stopping = True
+                    break
+                batch.append(message)
+            self.deliver(backend, batch)
+
+    def deliver(self, backend, batch):
+        for attempt in range(1, settings.SMS_MAX_ATTEMPTS + 1):
+            try:
+                backend.send_messages(batch)
+                return
+            except Exception as e:
+                if attempt == settings.SMS_MAX_ATTEMPTS:
+                    logger.error("Dropping %s SMS after %s attempts: %s", len(batch), attempt, e)
+                    return
+                logger.warning("SMS batch of %s failed (attempt %s): %s", len(batch), attempt, e)
+                time.sleep(settings.SMS_RETRY_BASE * 2 ** (attempt - 1))
+
+    def stop(self, timeout=None):
+        """Sends what is queued, waiting at most `timeout` seconds overall"""
+        if self.pid != os.getpid():
+            return
+        deadline = time.monotonic() + (settings.SMS_SHUTDOWN_TIMEOUT if timeout is None else timeout)
+        for _ in self.workers:
+            try:
+                self.queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        self.pid = None
+
+
+dispatcher = SMSDispatcher()
+atexit.register(dispatcher.stop)
+
+
+def send_sms(to, body):
+    """Queues an SMS and returns at once; raises SMSQueueFull when the queue is full"""
+    dispatcher.put(SMSMessage(to, body))
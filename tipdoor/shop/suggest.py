@@ -0,0 +1,182 @@
+"""
+Prefix autocomplete for the search box.
+
+Each process keeps sorted arrays of normalized product names, name word
+suffixes and SKUs, so completions are a binary search plus a short scan.
+The index follows the search version: local Product signals apply changes
+incrementally, and a change made by another process triggers a rebuild.
+The version is read at most every SUGGEST_VERSION_POLL_INTERVAL seconds,
+and a stale index keeps answering while a background thread rebuilds it.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .models import Product
+from .search import get_search_version, tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+class SuggestIndex:
+    """Sorted (key, product id) arrays, looked up in priority order"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Drops the index; the next lookup builds it again"""
+        with self._lock:
+            # The search version the index reflects, None when it is stale
+            self.version = None
+            self.built = False
+            self._checked_at = None
+            self._rebuild = None
+            self._products = {}
+            # Full names first, then matches on a later word of the name, then SKUs
+            self._keys = ([], [], [])
+
+    def build(self, version):
+        products = list(Product.objects.filter(is_published=True).values_list('id', 'name', 'sku'))
+        # Built aside and swapped in, so lookups are not held up meanwhile
+        documents, keys = {}, ([], [], [])
+        for product_id, name, sku in products:
+            documents[product_id] = (name, sku)
+            for index, key in self._entries(name, sku):
+                keys[index].append((key, product_id))
+        for entries in keys:
+            entries.sort()
+        with self._lock:
+            self._products, self._keys = documents, keys
+            self.version = version
+            self.built = True
+
+    def rebuild_in_background(self, version):
+        with self._lock:
+            if self._rebuild is not None and self._rebuild.is_alive():
+                return
+            self._rebuild = threading.Thread(target=self._build_in_thread, args=(version,), name='suggest-rebuild', daemon=True)
+            self._rebuild.start()
+
+    def _build_in_thread(self, version):
+        try:
+            self.build(version)
+        except DatabaseError:
+            logger.warning("Could not rebuild the product suggestion index", exc_info=True)
+        finally:
+            # The thread's own connection
+            connection.close()
+
+    def sync(self):
+        """Builds a missing index now, and starts rebuilding a stale one"""
+        now = time.monotonic()
+        with self._lock:
+            if self.built and self._checked_at is not None and now - self._checked_at < settings.SUGGEST_VERSION_POLL_INTERVAL:
+                return
+            self._checked_at = now
+        version = get_search_version()
+        if self.version == version:
+            return
+        if self.built:
+            self.rebuild_in_background(version)
+            return
+        with self._lock:
+            if not self.built:
+                self.build(version)
+
+    def update(self, product, version):
+        with self._lock:
+            if self.version is None:
+                return
+            # Another process changed the catalog since we last synced; rebuild
+            # on the next lookup
+            if self.version != version - 1:
+                self.version = self._checked_at = None
+                return
+            self._remove(product.pk)
+            if product.is_published:
+                self._products[product.pk] = (product.name, product.sku)
+                for array, key in self._entries(product.name, product.sku):
+                    bisect.insort(self._keys[array], (key, product.pk))
+            self.version = version
+
+    def remove(self, product_id, version):
+        with self._lock:
+            if self.version is None:
+                return
+            if self.version != version - 1:
+                self.version = self._checked_at = None
+                return
+            self._remove(product_id)
+            self.version = version
+
+    def suggest(self, query, limit):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        self.sync()
+        with self._lock:
+            suggestions, seen = [], set()
+            for keys in self._keys:
+                index = bisect.bisect_left(keys, (prefix,))
+                while index < len(keys) and len(suggestions) < limit:
+                    key, product_id = keys[index]
+                    if not key.startswith(prefix):
+                        break
+                    if product_id not in seen:
+                        seen.add(product_id)
+                        name, sku = self._products[product_id]
+                        suggestions.append({'id': product_id, 'name': name, 'sku': sku})
+                    index += 1
+            return suggestions
+
+    def _entries(self, name, sku):
+        """(array index, key) pairs of a product"""
+        tokens = tokenize(name)
+        if tokens:
+            yield 0, ' '.join(tokens)
+        for start in range(1, len(tokens)):
+            yield 1, ' '.join(tokens[start:])
+        if normalize(sku):
+            yield 2, normalize(sku)
+
+    def _remove(self, product_id):
+        document = self._products.pop(product_id, None)
+        if document is None:
+            return
+        for array, key in self._entries(*document):
+            keys = self._keys[array]
+            index = bisect.bisect_left(keys, (key, product_id))
+            if index < len(keys) and keys[index] == (key, product_id):
+                del keys[index]
+
+
+suggest_index = SuggestIndex()
+
+
+def warm_suggest_index():
+    """Builds the index when a worker starts, so the first keystroke is not slow"""
+    try:
+        suggest_index.build(get_search_version())
+    except DatabaseError:
+        # e.g. before the first migrate; the index is built on first use instead
+        logger.warning("Could not build the product suggestion index at startup", exc_info=True)
+
+
+def product_saved(product, version):
+    suggest_index.update(product, version)
+
+
+def product_deleted(product_id, version):
+    suggest_index.remove(product_id, version)
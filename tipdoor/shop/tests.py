@@ -1,3 +1,1456 @@
-from django.test import TestCase
+import io
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import os
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from delivery.models import DeliveryPartner
+from vendors.models import Vendor
+from . import ratelimit, search, sms
+from .authentication import user_cache_key
+from .cache import get_catalog_epoch
+from .cart import add_item, get_guest_cart, update_item
+from .inventory import InsufficientStock, release_stock, reserve_stock
+from .models import (
+    OTP, Cart, CartItem, Customer, EffectivePrice, IdempotencyKey, Order, OrderItem, OutboxMessage, Product, Promotion
+)
+from .promotions import PromotionResolver
+from .otp import CacheOTPStore, DatabaseOTPStore, get_otp_store, hash_code
+from .outbox import process_batch
+from .search import bump_search_version
+from .serializers import ProductSerializer
+from .sms import SMSQueueFull
+from .suggest import suggest_index
+
+logger = logging.getLogger(__name__)
+
+SHIPPING = {'address': '1 Main St', 'city': 'Pune', 'postal_code': '411001', 'country': 'India'}
+
+
+# Private in-memory caches, so tests neither see nor wipe the development cache
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'tests-{alias}'}
+    for alias in ('default', 'carts', 'sessions', 'versions')
+}
+
+
+def create_vendor():
+    user = User.objects.create_user('vendor', password='password')
+    return Vendor.objects.create(user=user, name='Vendor', email='vendor@example.com')
+
+
+def create_products(vendor, count):
+    return [
+        Product.objects.create(vendor=vendor, name=f'Widget {i}', price=10, sku=f'SKU{i}', stock=10)
+        for i in range(count)
+    ]
+
+
+def create_promotion(vendor, products, code='SAVE', **fields):
+    now = timezone.now()
+    fields = {
+        'title': code, 'start_date': now - timedelta(days=1), 'end_date': now + timedelta(days=1),
+        'discount_type': 'percentage', 'discount_value': 10, **fields
+    }
+    promotion = Promotion.objects.create(vendor=vendor, promo_code=code, **fields)
+    promotion.applicable_products.set(products)
+    return promotion
+
+
+def create_customer(number, name='Customer'):
+    user = User.objects.create_user(f'customer{number}')
+    return Customer.objects.create(user=user, mobile_number=f'{9000000000 + number}', name=name)
+
+
+def reset_caches():
+    for cache in caches.all():
+        cache.clear()
+    # The versions restart, so the per-process index must not look current
+    search._in_memory_backend.version = None
+    suggest_index.reset()
+    ratelimit._local_store.clear()
+
+
+@override_settings(CACHES=TEST_CACHES, SMS_BACKEND='shop.sms.LocmemBackend')
+class CatalogTestCase(TestCase):
+    """Thirty published products of one vendor, the first ten 10% off, and empty caches"""
+
+    def setUp(self):
+        reset_caches()
+        sms.LocmemBackend.outbox.clear()
+        self.vendor = create_vendor()
+        self.products = create_products(self.vendor, 30)
+        self.promotion = create_promotion(self.vendor, self.products[:10])
+        self.client = APIClient()
+
+    def walk(self, url):
+        """Follows `next` links from `url`; returns the pages"""
+        pages = []
+        while url:
+            pages.append(self.client.get(url).json())
+            url = pages[-1]['next']
+        return pages
+
+
+class CheckoutStockTests(TestCase):
+    def setUp(self):
+        self.vendor = create_vendor()
+        self.product = Product.objects.create(vendor=self.vendor, name='Last unit', price=10, sku='LAST', stock=1)
+        self.other = Product.objects.create(vendor=self.vendor, name='Plenty', price=5, sku='PLENTY', stock=10)
+
+    def customer_client(self, number, *lines):
+        user = User.objects.create_user(f'customer{number}')
+        customer = Customer.objects.create(user=user, mobile_number=f'90000000{number}')
+        cart = Cart.objects.create(customer=customer)
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def checkout(self, client):
+        return client.post('/api/orders/create/', {'shippingAddress': SHIPPING}, format='json')
+
+    def test_last_unit_is_sold_once(self):
+        first = self.customer_client(1, (self.product, 1), (self.other, 2))
+        second = self.customer_client(2, (self.other, 3), (self.product, 1))
+
+        self.assertEqual(self.checkout(first).status_code, 201)
+        response = self.checkout(second)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            [(line['product_id'], line['requested'], line['available']) for line in response.json()['lines']],
+            [(self.product.id, 1, 0)]
+        )
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        # The failed checkout must not keep the stock of its other lines
+        self.assertEqual(self.other.stock, 8)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cancellation_releases_stock_once(self):
+        client = self.customer_client(1, (self.product, 1), (self.other, 4))
+        order_id = self.checkout(client).json()['order_id']
+
+        vendor_client = APIClient()
+        vendor_client.force_authenticate(self.vendor.user)
+        url = f'/api/vendor/orders/{order_id}/status/'
+        self.assertEqual(vendor_client.post(url, {'status': 'CANCELLED'}).status_code, 200)
+        self.assertEqual(vendor_client.post(url, {'status': 'CANCELLED'}).status_code, 200)
+        self.assertEqual(vendor_client.post(url, {'status': 'APPROVED'}).status_code, 409)
+
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.product.stock, self.other.stock), (1, 10))
+
+
+class KeysetPaginationTests(CatalogTestCase):
+    def test_product_pages_cover_every_product_once(self):
+        # Ties on created_at are broken by id
+        Product.objects.filter(pk__in=[product.pk for product in self.products[5:15]]).update(created_at=timezone.now())
+
+        self.client.get('/api/products/?page_size=7')
+        with self.assertNumQueries(4):
+            self.client.get('/api/products/?page_size=7')
+        pages = self.walk('/api/products/?page_size=7')
+
+        ids = [product['id'] for page in pages for product in page['results']]
+        self.assertEqual(len(pages), 5)
+        self.assertEqual(sorted(ids), sorted(product.pk for product in self.products))
+
+    def test_previous_link_returns_the_previous_page(self):
+        pages = self.walk('/api/products/?page_size=7')
+
+        previous = self.client.get(pages[-1]['previous']).json()
+
+        self.assertEqual(previous['results'], pages[-2]['results'])
+        self.assertIsNotNone(previous['next'])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/products/?cursor=garbage').status_code, 404)
+
+    def test_order_history_pages(self):
+        customer = create_customer(1)
+        for _ in range(25):
+            Order.objects.create(
+                user=customer, address='1 Main St', city='Pune', postal_code='411001', country='India',
+                total_amount=10, discounted_total=10
+            )
+        Order.objects.update(created_at=timezone.now())
+        self.client.force_authenticate(customer.user)
+
+        pages = self.walk('/api/orders/?page_size=10')
+
+        ids = [order['id'] for page in pages for order in page['results']]
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+
+class ProductSearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(vendor=self.vendor, name='Blue Cotton Shirt', price=5, sku='SHIRT-1')
+        Product.objects.create(vendor=self.vendor, name='Red Shirt', price=5, sku='SHIRT-2', is_published=False)
+
+    def search(self, query):
+        return [product['name'] for product in self.client.get(f'/api/products/search?q={query}').json()['results']]
+
+    def test_matches_published_products_exactly_by_prefix_and_with_typos(self):
+        self.assertEqual(self.search('shirt'), ['Blue Cotton Shirt'])
+        self.assertEqual(self.search('cott'), ['Blue Cotton Shirt'])
+        self.assertEqual(self.search('shrit'), ['Blue Cotton Shirt'])
+        self.assertEqual(self.search('shirt-1'), ['Blue Cotton Shirt'])
+        self.assertEqual(self.search(''), [])
+
+    def test_saving_a_product_invalidates_cached_results(self):
+        self.search('shirt')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, name='Green Shirt', price=5, sku='SHIRT-3')
+
+        self.assertEqual(sorted(self.search('shirt')), ['Blue Cotton Shirt', 'Green Shirt'])
+        # The matched ids come from the cache; only the page is loaded
+        with self.assertNumQueries(3):
+            self.search('shirt')
+
+    def test_results_are_paginated(self):
+        pages = self.walk('/api/products/search?q=widget&page_size=7')
+
+        self.assertEqual(sum(len(page['results']) for page in pages), 30)
+
+
+class CatalogCacheTests(CatalogTestCase):
+    def test_product_detail_is_served_from_the_cache(self):
+        url = f'/api/products/{self.products[0].pk}/'
+        self.client.get(url)
+
+        # Only the validator lookup
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['promotion']['promo_code'], 'SAVE')
+
+    def test_product_and_promotion_changes_invalidate_the_detail(self):
+        product = self.products[0]
+        url = f'/api/products/{product.pk}/'
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promotion.applicable_products.remove(product)
+        self.assertIsNone(self.client.get(url).json()['promotion'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 99
+            product.save()
+        self.assertEqual(self.client.get(url).json()['price'], '99.00')
+
+    def test_entries_roll_over_when_a_promotion_starts_and_ends(self):
+        product = self.products[20]
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_promotion(
+                self.vendor, [product], code='LATER', start_date=now + timedelta(hours=1),
+                end_date=now + timedelta(hours=2), discount_type='fixed', discount_value=1
+            )
+        url = f'/api/products/{product.pk}/'
+
+        self.assertIsNone(self.client.get(url).json()['promotion'])
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(hours=1, minutes=1)):
+            self.assertEqual(self.client.get(url).json()['promotion']['promo_code'], 'LATER')
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(hours=3)):
+            self.assertIsNone(self.client.get(url).json()['promotion'])
+
+    def test_latest_arrivals_are_served_from_the_cache(self):
+        self.client.get('/api/latest-arrivals/')
+
+        # Only the latest product update, which stock changes move
+        with self.assertNumQueries(1):
+            self.client.get('/api/latest-arrivals/')
+
+    def test_stock_changes_refresh_only_what_shows_stock(self):
+        url = f'/api/products/{self.products[0].pk}/'
+        self.client.get(url)
+        facets = self.client.get('/api/products/facets/').json()
+        epoch = get_catalog_epoch()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock({self.products[0].pk: 10})
+        self.assertEqual(get_catalog_epoch(), epoch)
+        self.assertEqual(self.client.get(url).json()['stock'], 0)
+        self.assertNotEqual(self.client.get('/api/products/facets/').json(), facets)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock({self.products[0].pk: 10})
+        self.assertEqual(self.client.get(url).json()['stock'], 10)
+        self.assertEqual(self.client.get('/api/products/facets/').json(), facets)
+
+    def test_catalog_version_survives_culling_of_the_default_cache(self):
+        epoch = get_catalog_epoch()
+
+        caches['default'].clear()
+
+        self.assertEqual(get_catalog_epoch(), epoch)
+
+
+class ConditionalGetTests(CatalogTestCase):
+    def test_product_detail_answers_304(self):
+        url = f'/api/products/{self.products[0].pk}/'
+        response = self.client.get(url)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promotion.applicable_products.remove(self.products[0])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get('/api/products/999999/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+    def test_product_list_answers_304_until_a_product_changes(self):
+        etag = self.client.get('/api/products/')['ETag']
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/products/?page_size=3', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Product.objects.filter(pk=self.products[3].pk).update(name='Renamed', updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_is_private_and_answers_304_until_it_changes(self):
+        self.client.post('/api/cart/add/', {'product_id': self.products[0].pk, 'quantity': 1})
+        response = self.client.get('/api/cart/')
+        etag = response['ETag']
+
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get('/api/cart/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        line_id = response.json()['items'][0]['id']
+        self.client.patch(f'/api/cart/update/{line_id}/', {'quantity': 3})
+        response = self.client.get('/api/cart/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'][0]['quantity'], 3)
+
+    def test_empty_guest_cart_answers_304(self):
+        response = self.client.get('/api/cart/')
+
+        later = timezone.now() + timedelta(minutes=5)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = APIClient().get(
+                '/api/cart/', HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+        self.assertEqual(response.status_code, 304)
+
+
+def png_upload(width, height):
+    data = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(data, 'PNG')
+    return SimpleUploadedFile('image.png', data.getvalue(), content_type='image/png')
+
+
+class ImageDerivativeTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVES_ASYNC=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_upload_builds_variants_no_wider_than_the_original(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(vendor=self.vendor, name='Lamp', price=1, sku='LAMP', image=png_upload(800, 600))
+
+        product.refresh_from_db()
+        self.assertEqual([width for width, _ in product.image_variants['webp']], [320, 640, 800])
+        srcset = self.client.get(f'/api/products/{product.pk}/').json()['image_srcset']
+        self.assertIn('320w', srcset['webp'])
+
+        response = self.client.get(srcset['jpeg'].split(' ')[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_command_builds_missing_variants(self):
+        product = Product.objects.create(vendor=self.vendor, name='Lamp', price=1, sku='LAMP', image=png_upload(400, 300))
+        self.assertFalse(product.image_variants)
+
+        out = io.StringIO()
+        call_command('build_image_derivatives', stdout=out)
+
+        product.refresh_from_db()
+        self.assertIn('Product: built derivatives for 1 images', out.getvalue())
+        self.assertEqual([width for width, _ in product.image_variants['webp']], [320, 400])
+
+
+class ProductFilterTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        # 20 in stock, 5 out of stock, 5 low on stock at a higher price
+        Product.objects.filter(pk__in=[product.pk for product in self.products[20:25]]).update(stock=0)
+        Product.objects.filter(pk__in=[product.pk for product in self.products[25:]]).update(stock=3, price=100)
+        call_command('refresh_effective_prices', '--all', stdout=io.StringIO())
+
+    def count(self, query):
+        return len(self.client.get(f'/api/products/?page_size=100&{query}').json()['results'])
+
+    def test_filters(self):
+        self.assertEqual(self.count('stock=out_of_stock'), 5)
+        self.assertEqual(self.count('stock=out_of_stock,low_stock'), 10)
+        self.assertEqual(self.count('on_promotion=true'), 10)
+        self.assertEqual(self.count('on_promotion=false'), 20)
+        self.assertEqual(self.count('min_price=50'), 5)
+        self.assertEqual(self.count(f'vendor={self.vendor.pk}&max_price=10'), 25)
+
+    def test_on_promotion_agrees_with_the_discounted_price_sort(self):
+        # Linked without signals, so the effective prices do not know yet
+        Promotion.applicable_products.through.objects.create(promotion=self.promotion, product=self.products[15])
+        self.assertEqual(self.count('on_promotion=true'), 10)
+
+        call_command('refresh_effective_prices', '--all', stdout=io.StringIO())
+
+        discounted = self.client.get('/api/products/?page_size=100&on_promotion=true&sort=discounted_price').json()['results']
+        cheapest = self.client.get('/api/products/?page_size=11&sort=discounted_price').json()['results']
+        self.assertEqual(len(discounted), 11)
+        self.assertEqual({product['id'] for product in discounted}, {product['id'] for product in cheapest})
+
+    def test_invalid_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/products/?stock=plenty').status_code, 400)
+        self.assertEqual(self.client.get('/api/products/?min_price=5&max_price=1').status_code, 400)
+
+    def test_sorted_pages_cover_every_product_in_order(self):
+        pages = self.walk('/api/products/?page_size=7&sort=discounted_price')
+        prices = [product['discounted_price'] or float(product['price']) for page in pages for product in page['results']]
+        self.assertEqual(len(prices), 30)
+        self.assertEqual(prices, sorted(prices))
+
+        pages = self.walk('/api/products/?page_size=7&sort=-price')
+        self.assertEqual(len({product['id'] for page in pages for product in page['results']}), 30)
+
+    def test_facets(self):
+        facets = self.client.get('/api/products/facets/').json()
+
+        self.assertEqual(facets['total'], 30)
+        self.assertEqual(
+            {status['value']: status['count'] for status in facets['stock_status']},
+            {'in_stock': 20, 'low_stock': 5, 'out_of_stock': 5}
+        )
+        self.assertEqual(facets['price_ranges'][0]['count'], 25)
+        self.assertEqual(facets['vendors'][0]['count'], 30)
+        self.assertEqual(self.client.get('/api/products/facets/?on_promotion=1').json()['total'], 10)
+        # Cached, keyed on the latest product update
+        with self.assertNumQueries(1):
+            self.client.get('/api/products/facets/')
+
+
+class ProductSuggestTests(CatalogTestCase):
+    def suggest(self, query):
+        return [product['name'] for product in self.client.get(f'/api/products/suggest/?q={query}').json()['results']]
+
+    def test_completes_names_later_words_and_skus_without_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, name='Blue Cotton Shirt', price=5, sku='SHIRT-1')
+        self.suggest('x')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('cot'), ['Blue Cotton Shirt'])
+        self.assertEqual(self.suggest('widget 1&limit=3'), ['Widget 1', 'Widget 10', 'Widget 11'])
+        self.assertEqual(self.client.get('/api/products/suggest/?q=shirt-').json()['results'][0]['sku'], 'SHIRT-1')
+        self.assertEqual(self.client.get('/api/products/suggest/?q=a&limit=x').status_code, 400)
+
+    def test_local_changes_are_applied_incrementally(self):
+        self.suggest('x')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(vendor=self.vendor, name='Cotton Socks', price=5, sku='SOCK')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('cotton'), ['Cotton Socks'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.is_published = False
+            product.save()
+        self.assertEqual(self.suggest('cotton'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[0].pk).delete()
+        self.assertNotIn('Widget 0', self.suggest('widget 0'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ProductSuggestRebuildTests(TransactionTestCase):
+    """Another process's changes, which need a rebuild that can see committed rows"""
+
+    def setUp(self):
+        reset_caches()
+        self.vendor = create_vendor()
+        Product.objects.create(vendor=self.vendor, name='Old Lamp', price=1, sku='LAMP-1')
+
+    def suggest(self, query):
+        return [product['name'] for product in APIClient().get(f'/api/products/suggest/?q={query}').json()['results']]
+
+    def test_stale_index_keeps_answering_while_it_is_rebuilt(self):
+        self.assertEqual(self.suggest('lamp'), ['Old Lamp'])
+        # As another process would: no local signal reaches the index
+        Product.objects.bulk_create([Product(vendor=self.vendor, name='New Lamp', price=1, sku='LAMP-2')])
+        bump_search_version()
+
+        with self.settings(SUGGEST_VERSION_POLL_INTERVAL=60), self.assertNumQueries(0):
+            self.assertEqual(self.suggest('lamp'), ['Old Lamp'])
+
+        with self.settings(SUGGEST_VERSION_POLL_INTERVAL=0):
+            self.assertEqual(self.suggest('lamp'), ['Old Lamp'])
+            suggest_index._rebuild.join(5)
+            self.assertEqual(self.suggest('lamp'), ['Old Lamp', 'New Lamp'])
+
+
+class ProductImportTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        other = Vendor.objects.create(user=User.objects.create_user('other'), name='Other', email='other@example.com')
+        Product.objects.create(vendor=other, name='Theirs', price=1, sku='THEIRS')
+        self.client.force_authenticate(self.vendor.user)
+
+    def upload(self, name, content, **data):
+        return self.client.post(
+            '/api/vendor/products/import/', {'file': SimpleUploadedFile(name, content.encode()), **data}, format='multipart'
+        ).json()
+
+    def test_csv_creates_and_updates_by_sku_and_reports_bad_rows(self):
+        result = self.upload(
+            'products.csv',
+            "sku,name,price,stock\n"
+            "SKU0,,12.50,\n"        # update: blank cells keep the current values
+            "NEW1,New one,3,4\n"
+            "NEW2,,3,\n"            # a new product needs a name
+            "THEIRS,x,1,1\n"        # another vendor's SKU
+            "SKU1,,-1,\n"
+            "NEW1,New one b,3,5\n"  # a repeated SKU, last one wins
+        )
+
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 3), result)
+        self.assertEqual(sorted(error['line'] for error in result['errors']), [4, 5, 6])
+        product = Product.objects.get(sku='SKU0')
+        self.assertEqual((product.price, product.name, product.stock), (Decimal('12.50'), 'Widget 0', 10))
+        # Prices refreshed for the promotion; search sees the new product
+        self.assertEqual(EffectivePrice.objects.get(product=product).discounted_price, Decimal('11.25'))
+        self.assertEqual(Product.objects.get(sku='NEW1').name, 'New one b')
+        self.assertEqual(len(self.client.get('/api/products/search?q=new').json()['results']), 1)
+
+    def test_json_lines(self):
+        result = self.upload(
+            'products.txt', '{"sku": "J1", "name": "J", "price": "2"}\nnot json\n[1]\n{"sku": "SKU2", "stock": 0}\n', format='jsonl'
+        )
+
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 2), result)
+        self.assertEqual(Product.objects.get(sku='SKU2').stock, 0)
+
+    def test_command_imports_in_chunks(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('sku,name,price\n' + ''.join(f'C{i},Item {i},{i + 1}\n' for i in range(1200)))
+        self.addCleanup(os.unlink, f.name)
+
+        out = io.StringIO()
+        call_command('import_products', f.name, '--vendor', str(self.vendor.pk), '--chunk-size', '500', stdout=out)
+
+        self.assertIn('Created 1200', out.getvalue())
+        self.assertEqual(Product.objects.filter(sku__startswith='C').count(), 1200)
+
+
+class CheckoutQueryTests(CatalogTestCase):
+    def checkout(self, number, lines, promo_code=''):
+        """Checks out `lines` products, two of each; returns the response, its query count and the cart"""
+        customer = create_customer(number)
+        cart = Cart.objects.create(customer=customer)
+        for product in self.products[:lines]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        self.client.force_authenticate(customer.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/orders/create/', {'shippingAddress': SHIPPING, 'promo_code': promo_code}, format='json')
+        return response, len(queries), cart
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        # The first checkout also computes the catalog epoch
+        self.checkout(1, 3, 'SAVE')
+
+        _, five_lines, _ = self.checkout(2, 5, 'SAVE')
+        response, ten_lines, cart = self.checkout(3, 10, 'SAVE')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(five_lines, ten_lines)
+        order = response.json()
+        self.assertEqual(len(order['items']), 10)
+        self.assertEqual(order['items'][0]['discounted_price'], 9.0)
+        self.assertEqual(float(order['discounted_total']), 180.0)
+        self.assertFalse(CartItem.objects.filter(cart=cart).exists())
+
+    def test_every_line_becomes_an_order_item(self):
+        response, _, _ = self.checkout(1, 20)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.json()['order_id']).count(), 20)
+
+
+class IdempotencyKeyTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        customer = create_customer(1)
+        cart = Cart.objects.create(customer=customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=2)
+        self.client.force_authenticate(customer.user)
+
+    def checkout(self, key=None, shipping=SHIPPING):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key is not None else {}
+        return self.client.post('/api/orders/create/', {'shippingAddress': shipping}, format='json', **headers)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.checkout('key-1')
+        second = self.checkout('key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((second.status_code, second.content), (201, first.content))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.checkout('key-1')
+
+        response = self.checkout('key-1', {**SHIPPING, 'city': 'Mumbai'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_does_not_keep_its_key(self):
+        self.checkout()
+
+        # The cart is empty now
+        self.assertEqual(self.checkout('key-2').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.filter(key='key-2').exists())
+
+    def test_empty_key_is_rejected(self):
+        self.assertEqual(self.checkout('').status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class GuestCartTests(CatalogTestCase):
+    def add(self, product, quantity=None):
+        data = {'product_id': product.pk} if quantity is None else {'product_id': product.pk, 'quantity': quantity}
+        return self.client.post('/api/cart/add/', data, format='json')
+
+    def test_guest_cart_lives_in_the_cache(self):
+        response = self.add(self.products[0], 2)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        cart = response.json()
+        self.assertIsNone(cart['id'])
+        self.assertEqual(cart['items'][0]['quantity'], 2)
+        self.assertEqual(cart['items'][0]['product']['discounted_price'], 9.0)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(APIClient().get('/api/cart/').json()['items'], [])
+
+    def test_lines_are_numbered_within_the_cart(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[0], 1)
+        cart = self.add(self.products[1]).json()
+        self.assertEqual([(item['id'], item['quantity']) for item in cart['items']], [(1, 3), (2, 1)])
+
+        cart = self.client.patch('/api/cart/update/2/', {'quantity': 5}, format='json').json()
+        self.assertEqual(cart['items'][1]['quantity'], 5)
+        self.assertEqual(self.client.delete('/api/cart/remove/9/').status_code, 404)
+        cart = self.client.delete('/api/cart/remove/1/').json()
+        self.assertEqual([(item['id'], item['quantity']) for item in cart['items']], [(2, 5)])
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], cart['items'])
+
+    def test_concurrent_changes_are_not_lost(self):
+        request = RequestFactory().post('/api/cart/add/')
+        request.session = SessionStore()
+        add_item(request, get_guest_cart(request), self.products[0], 1)
+
+        # Two requests that loaded the cart before either saved it
+        first, second = get_guest_cart(request), get_guest_cart(request)
+        add_item(request, first, self.products[1], 1)
+        add_item(request, second, self.products[2], 2)
+
+        self.assertEqual(
+            [(product_id, quantity) for _, product_id, quantity in get_guest_cart(request).lines],
+            [(self.products[0].pk, 1), (self.products[1].pk, 1), (self.products[2].pk, 2)]
+        )
+        self.assertFalse(update_item(request, first, 99, 3))
+
+
+class CartBatchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.operations = [{'op': 'add', 'product_id': product.pk, 'quantity': 2} for product in self.products]
+        self.operations += [
+            {'op': 'remove', 'product_id': self.products[1].pk},
+            {'op': 'set', 'product_id': self.products[2].pk, 'quantity': 7},
+        ]
+
+    def batch(self, operations, **data):
+        return self.client.post('/api/cart/batch/', {'operations': operations, **data}, format='json')
+
+    def test_single_adds_add_up(self):
+        customer = create_customer(1)
+        self.client.force_authenticate(customer.user)
+
+        for quantity in (1, 2):
+            response = self.client.post('/api/cart/add/', {'product_id': self.products[0].pk, 'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+
+        self.assertEqual(CartItem.objects.get(cart__customer=customer).quantity, 3)
+
+    def test_operations_apply_in_order_as_one_change(self):
+        customer = create_customer(1)
+        cart = Cart.objects.create(customer=customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=cart, product=self.products[1], quantity=1)
+        self.client.force_authenticate(customer.user)
+
+        response = self.batch(self.operations, response='delta')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        delta = response.json()
+        quantities = {item['product']['id']: item['quantity'] for item in delta['items']}
+        self.assertEqual(len(quantities), 29)
+        self.assertEqual(len(delta['removed']), 1)
+        self.assertEqual((quantities[self.products[0].pk], quantities[self.products[2].pk]), (3, 7))
+        self.assertEqual(delta['totals']['quantity'], 3 + 7 + 27 * 2)
+        # Ten of the products are 10% off
+        self.assertEqual((delta['totals']['total'], delta['totals']['discounted_total']), ('640.00', '616.00'))
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 29)
+
+        cart = self.batch([{'op': 'remove', 'product_id': self.products[0].pk}]).json()
+        self.assertEqual(len(cart['items']), 28)
+
+    def test_invalid_batches_change_nothing(self):
+        self.assertEqual(self.batch([{'op': 'add', 'product_id': 999999, 'quantity': 1}]).status_code, 404)
+        self.assertEqual(self.batch([{'op': 'add', 'product_id': self.products[0].pk}]).status_code, 400)
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+
+    def test_guest_batch(self):
+        operations = self.operations[:3] + [{'op': 'remove', 'product_id': self.products[0].pk}]
+
+        delta = self.batch(operations, response='delta').json()
+
+        self.assertEqual([item['id'] for item in delta['items']], [1, 2])
+        self.assertEqual(delta['totals']['lines'], 2)
+        self.assertEqual(len(self.client.get('/api/cart/').json()['items']), 2)
+
+
+class GuestCartMergeTests(CatalogTestCase):
+    def log_in(self, client, mobile_number):
+        get_otp_store().issue(mobile_number, '123456')
+        return client.post('/api/auth/otp/verify/', {'mobile_number': mobile_number, 'otp': '123456'}, format='json')
+
+    def guest_with(self, lines):
+        client = APIClient()
+        operations = [{'op': 'add', 'product_id': product.pk, 'quantity': quantity} for product, quantity in lines]
+        client.post('/api/cart/batch/', {'operations': operations}, format='json')
+        return client
+
+    def test_merge_query_count_does_not_grow_with_the_cart(self):
+        counts = []
+        for mobile_number, size in (('9100000001', 3), ('9100000002', 25)):
+            client = self.guest_with([(product, 1) for product in self.products[:size]])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.log_in(client, mobile_number)
+            counts.append(len(queries))
+
+            self.assertTrue(response.json()['is_new_user'])
+            self.assertEqual(CartItem.objects.filter(cart__customer__mobile_number=mobile_number).count(), size)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_quantities_add_up_and_the_guest_cart_is_emptied(self):
+        customer = create_customer(1)
+        cart = Cart.objects.create(customer=customer)
+        CartItem.objects.create(cart=cart, product=self.products[1], quantity=1)
+        client = self.guest_with([(self.products[0], 2), (self.products[1], 5)])
+
+        response = self.log_in(client, customer.mobile_number)
+
+        self.assertFalse(response.json()['is_new_user'])
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')),
+            {self.products[0].pk: 2, self.products[1].pk: 6}
+        )
+        client.credentials()
+        self.assertEqual(client.get('/api/cart/').json()['items'], [])
+
+
+class QuoteTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = create_customer(1)
+        cart = Cart.objects.create(customer=self.customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=3)
+        CartItem.objects.create(cart=cart, product=self.products[20], quantity=1)
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal('9.99'))
+        self.client.force_authenticate(self.customer.user)
+
+    def test_quote_rounds_each_line_and_is_cached(self):
+        quote = self.client.get('/api/orders/quote/?promo_code=SAVE').json()
+
+        # 9.99 less 10% is 8.991, rounded per unit before multiplying
+        self.assertEqual(quote['lines'][0]['discounted_price'], '8.99')
+        self.assertEqual((quote['subtotal'], quote['discount'], quote['total']), ('39.97', '3.00', '36.97'))
+        with self.assertNumQueries(1):
+            self.client.get('/api/orders/quote/?promo_code=SAVE')
+
+    def test_unknown_promo_code(self):
+        self.assertEqual(self.client.get('/api/orders/quote/?promo_code=NOPE').status_code, 400)
+
+    def test_checkout_charges_the_quoted_total(self):
+        quote = self.client.get('/api/orders/quote/?promo_code=SAVE').json()
+        body = {'shippingAddress': SHIPPING, 'promo_code': 'SAVE'}
+
+        response = self.client.post('/api/orders/create/', body, format='json')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        order = response.json()
+        self.assertEqual(Decimal(str(order['discounted_total'])), Decimal(quote['total']))
+        self.assertEqual(Decimal(str(order['total'])), Decimal(quote['subtotal']))
+        line = OrderItem.objects.get(order_id=order['order_id'], product=self.products[0])
+        self.assertEqual(line.discounted_price, Decimal('8.99'))
+        self.assertEqual(self.client.post('/api/orders/create/', body, format='json').json()['error'], 'Cart is empty')
+
+
+class OrderHistoryTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = create_customer(1, name='Cee')
+        for i in range(20):
+            order = Order.objects.create(
+                user=self.customer, address='1 Main St', city='Pune', postal_code='411001', country='India',
+                total_amount=20, discounted_total=18
+            )
+            OrderItem.objects.create(order=order, product=self.products[i], quantity=2, price=10, discounted_price=9)
+            OrderItem.objects.create(order=order, product=self.products[i + 1], quantity=1, price=10)
+
+    def test_customer_history_query_count(self):
+        self.client.force_authenticate(self.customer.user)
+        with self.assertNumQueries(2):
+            page = self.client.get('/api/orders/').json()
+
+        order = page['results'][0]
+        self.assertEqual(order['discounted_total'], 18.0)
+        self.assertEqual(order['items'][0]['customer_name'], 'Cee')
+
+    def test_vendor_history_query_count(self):
+        self.client.force_authenticate(self.vendor.user)
+        with self.assertNumQueries(1):
+            page = self.client.get('/api/vendor/orders/').json()
+
+        self.assertEqual(page['results'][0]['customer_name'], 'Cee')
+
+
+class OutboxTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        customer = create_customer(1)
+        # Partners are matched on the address appearing in their service area
+        self.order = Order.objects.create(
+            user=customer, address='Pune', city='Pune', postal_code='411001', country='India',
+            total_amount=10, discounted_total=10
+        )
+        OrderItem.objects.create(order=self.order, product=self.products[0], quantity=1, price=10)
+        for i in range(3):
+            DeliveryPartner.objects.create(
+                user=User.objects.create_user(f'partner{i}'), name='Partner', phone='1',
+                vehicle_type='BIKE', service_area='Pune'
+            )
+
+    @mock.patch('shop.notifications.send_notification')
+    def test_approval_notifies_after_commit_with_retries(self, send):
+        self.client.force_authenticate(self.vendor.user)
+        response = self.client.post(f'/api/vendor/orders/{self.order.id}/status/', {'status': 'APPROVED'})
+
+        self.assertEqual(response.status_code, 200)
+        send.assert_not_called()
+        self.assertEqual(OutboxMessage.objects.get().topic, 'order.approved')
+        # (delivered, retried, dead)
+        self.assertEqual(process_batch(), (1, 0, 0))
+        send.side_effect = [None, RuntimeError('boom'), None]
+        with self.assertLogs('shop.outbox', 'WARNING'):
+            self.assertEqual(process_batch(), (2, 1, 0))
+        # The failed message is backing off
+        self.assertEqual(process_batch(), (0, 0, 0))
+
+        OutboxMessage.objects.filter(status=OutboxMessage.PENDING).update(available_at=timezone.now())
+        send.side_effect = RuntimeError('again')
+        with self.settings(OUTBOX_MAX_ATTEMPTS=2), self.assertLogs('shop.outbox', 'ERROR'):
+            self.assertEqual(process_batch(), (0, 0, 1))
+        self.assertIn('again', OutboxMessage.objects.get(status=OutboxMessage.DEAD).last_error)
+
+    def test_unknown_topic_is_dead_lettered(self):
+        OutboxMessage.objects.create(topic='unknown')
+        out = io.StringIO()
+
+        with self.assertLogs('shop.outbox', 'ERROR'):
+            call_command('run_outbox', '--once', stdout=out)
+
+        self.assertIn('dead 1', out.getvalue())
+
+
+class PurgeStaleDataTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        old = timezone.now() - timedelta(days=30)
+        carts = [Cart.objects.create(session_key=f'session{i}') for i in range(25)]
+        for cart in carts:
+            CartItem.objects.create(cart=cart, product=self.products[0])
+        Cart.objects.filter(pk__in=[cart.pk for cart in carts[:20]]).update(updated_at=old)
+        for _ in range(5):
+            OTP.objects.create(mobile_number='9000000001', code_hash='old', expires_at=old)
+        OTP.objects.create(mobile_number='9000000001', code_hash='new', expires_at=timezone.now() + timedelta(minutes=5))
+        Session.objects.create(session_key='expired', session_data='', expire_date=old)
+        Session.objects.create(session_key='current', session_data='', expire_date=timezone.now() + timedelta(days=1))
+        OutboxMessage.objects.create(topic='order.approved', status=OutboxMessage.DONE, processed_at=old)
+        OutboxMessage.objects.create(topic='order.approved', status=OutboxMessage.DEAD, processed_at=old)
+
+    def purge(self, *args):
+        out = io.StringIO()
+        call_command('purge_stale_data', '--batch-size', '7', '--sleep', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_only_counts(self):
+        output = self.purge('--dry-run')
+
+        self.assertIn('carts: would delete 20 rows in 3 batches', output)
+        self.assertEqual(Cart.objects.count(), 25)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_purge_keeps_live_and_dead_lettered_rows(self):
+        self.purge()
+
+        self.assertEqual(Cart.objects.count(), 5)
+        self.assertEqual(CartItem.objects.count(), 5)
+        self.assertEqual(OTP.objects.get().code_hash, 'new')
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), ['current'])
+        self.assertEqual(OutboxMessage.objects.get().status, OutboxMessage.DEAD)
+
+    def test_only_one_target(self):
+        output = self.purge('--only', 'otps')
+
+        self.assertEqual(output.count('\n'), 1)
+        self.assertEqual(Cart.objects.count(), 25)
+
+
+class RateLimitTests(CatalogTestCase):
+    def send(self, mobile_number, client=None):
+        return (client or self.client).post('/api/auth/otp/send/', {'mobile_number': mobile_number}, format='json')
+
+    def verify(self, mobile_number, code):
+        return self.client.post('/api/auth/otp/verify/', {'mobile_number': mobile_number, 'otp': code}, format='json')
+
+    def test_mobile_number_bucket(self):
+        for _ in range(3):
+            self.assertEqual(self.send('9000000001').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.send('9000000001')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 20)
+        self.assertEqual(self.send('9000000002').status_code, 200)
+
+    def test_failed_verifications_are_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.verify('9000000001', '111111').status_code, 400)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify('9000000001', '111111').status_code, 429)
+
+    def test_spellings_of_a_number_share_a_bucket(self):
+        spellings = ['9000000001', ' 9000000001', '9000000001 ', '\t9000000001', '\n 9000000001']
+        for mobile_number in spellings:
+            self.assertEqual(self.verify(mobile_number, '111111').status_code, 400)
+
+        self.assertEqual(self.verify('  9000000001\t', '111111').status_code, 429)
+
+    def test_ip_bucket(self):
+        statuses = [self.send(f'90000001{i:02d}').status_code for i in range(24)]
+
+        self.assertEqual(statuses.count(429), 4)
+        self.assertEqual(self.send('9000000555', APIClient(REMOTE_ADDR='10.0.0.9')).status_code, 200)
+
+    def test_body_that_is_not_an_object(self):
+        response = self.client.post('/api/auth/otp/send/', [], format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_cache_bucket_store(self):
+        store = ratelimit.CacheBucketStore(caches['default'])
+
+        self.assertEqual([store.take('key', 2, 60) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(store.take('key', 2, 60), 30, delta=1)
+        self.assertEqual(store.take('other', 2, 60), 0)
+        # A refund makes the next token available at once
+        store.take('key', 2, 60, cost=-1)
+        self.assertEqual(store.take('key', 2, 60), 0)
+
+
+class OTPStoreTests(CatalogTestCase):
+    def test_codes_are_single_use(self):
+        for store in (CacheOTPStore('default', 60), DatabaseOTPStore(60)):
+            with self.subTest(store=type(store).__name__):
+                store.issue('9000000001', '123456')
+
+                self.assertFalse(store.consume('9000000001', '654321'))
+                self.assertFalse(store.consume('9000000002', '123456'))
+                self.assertTrue(store.consume('9000000001', '123456'))
+                self.assertFalse(store.consume('9000000001', '123456'))
+
+    def test_discarded_code_is_rejected(self):
+        for store in (CacheOTPStore('default', 60), DatabaseOTPStore(60)):
+            with self.subTest(store=type(store).__name__):
+                store.issue('9000000001', '123456')
+                store.discard('9000000001', '123456')
+
+                self.assertFalse(store.consume('9000000001', '123456'))
+
+    def test_database_store_keeps_only_a_hash(self):
+        store = DatabaseOTPStore(60)
+        store.issue('9000000001', '111111')
+
+        self.assertEqual(OTP.objects.get().code_hash, hash_code('9000000001', '111111'))
+        OTP.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.assertNumQueries(1):
+            self.assertFalse(store.consume('9000000001', '111111'))
+
+    def test_login_consumes_the_code(self):
+        with mock.patch('shop.views.generate_code', return_value='424242'):
+            self.client.post('/api/auth/otp/send/', {'mobile_number': '9000000001'}, format='json')
+        body = {'mobile_number': '9000000001', 'otp': '424242'}
+
+        self.assertEqual(self.client.post('/api/auth/otp/verify/', body, format='json').status_code, 200)
+        response = self.client.post('/api/auth/otp/verify/', body, format='json')
+        self.assertEqual(response.json()['error'], 'Invalid or expired OTP')
+
+    @mock.patch('shop.views.send_sms', side_effect=SMSQueueFull)
+    def test_full_sms_queue_costs_no_attempt(self, send_sms):
+        for _ in range(5):
+            response = self.client.post('/api/auth/otp/send/', {'mobile_number': '9000000001'}, format='json')
+            self.assertEqual(response.status_code, 503)
+        self.assertFalse(OTP.objects.exists())
+
+        send_sms.side_effect = None
+        statuses = [
+            self.client.post('/api/auth/otp/send/', {'mobile_number': '9000000001'}, format='json').status_code
+            for _ in range(4)
+        ]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+class CachedAuthenticationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = create_customer(1, name='Cee')
+
+    def bearer(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client
+
+    def test_second_request_skips_the_user_query(self):
+        client = self.bearer(self.vendor.user)
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(client.get('/api/vendor/products/').status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(client.get('/api/vendor/products/').status_code, 200)
+
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertNotIn('auth_user', second[0]['sql'])
+        # The product and its update; the vendor profile came from the cache
+        with self.assertNumQueries(2):
+            self.assertEqual(client.post(f'/api/vendor/products/{self.products[0].pk}/publish/').status_code, 200)
+
+    def test_missing_profile_is_cached(self):
+        client = self.bearer(self.customer.user)
+        self.assertEqual(client.get('/api/user/').json()['name'], 'Cee')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/vendor/products/').status_code, 403)
+            self.assertEqual(client.get('/api/user/').json()['name'], 'Cee')
+
+    def test_saving_evicts_the_entry(self):
+        client = self.bearer(self.customer.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.patch('/api/user/', {'name': 'Dee'}, format='json').status_code, 200)
+        self.assertEqual(client.get('/api/user/').json()['name'], 'Dee')
+
+        user = User.objects.get(pk=self.customer.user_id)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(client.get('/api/user/').status_code, 401)
+
+    def test_password_hash_is_not_cached(self):
+        user = self.customer.user
+        user.set_password('secret')
+        user.save()
+        client = self.bearer(user)
+        client.get('/api/user/')
+        client.get('/api/user/')
+
+        self.assertNotIn('password', caches['default'].get(user_cache_key(user.pk))['user'])
+        # A user rebuilt from the cache has the hash deferred, so saving it keeps the password
+        request_user = client.get('/api/user/').wsgi_request.user
+        request_user.first_name = 'Cee'
+        request_user.save()
+        self.assertTrue(User.objects.get(pk=user.pk).check_password('secret'))
+
+    # simplejwt modules hold on to the settings object, so override_settings does not reach them
+    @mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True)
+    def test_password_change_revokes_tokens(self):
+        user = self.customer.user
+        client = self.bearer(user)
+        self.assertEqual(client.get('/api/user/').status_code, 200)
+
+        user.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        self.assertEqual(client.get('/api/user/').status_code, 401)
+
+
+class SessionTests(CatalogTestCase):
+    def add_to_cart(self, client):
+        return client.post('/api/cart/add/', {'product_id': self.products[0].pk, 'quantity': 2}, format='json')
+
+    def test_guest_carts_write_no_session_rows(self):
+        self.add_to_cart(self.client)
+
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(self.client.get('/api/cart/').json()['items'][0]['quantity'], 2)
+
+    def test_legacy_database_session_is_migrated(self):
+        for backend in ('signed_cookies', 'cache'):
+            with self.subTest(backend=backend):
+                legacy_client = APIClient()
+                with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.db'):
+                    self.add_to_cart(legacy_client)
+                legacy_key = legacy_client.cookies[settings.SESSION_COOKIE_NAME].value
+                self.assertTrue(Session.objects.filter(pk=legacy_key).exists())
+
+                with self.settings(SESSION_ENGINE=settings.SESSION_ENGINES[backend]):
+                    # A client binds its session engine on first use, so start a new one
+                    client = APIClient()
+                    client.cookies = legacy_client.cookies
+                    self.assertEqual(client.get('/api/cart/').json()['items'][0]['quantity'], 2)
+                    self.assertNotEqual(client.cookies[settings.SESSION_COOKIE_NAME].value, legacy_key)
+                    # The cart's products and prices; no session lookup
+                    with self.assertNumQueries(3):
+                        response = client.get('/api/cart/')
+                self.assertEqual(response.json()['items'][0]['quantity'], 2)
+
+
+class SMSTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        # Workers pick up the settings when the dispatcher starts
+        sms.dispatcher.stop()
+        self.addCleanup(sms.dispatcher.stop)
+
+    def send(self, mobile_number):
+        return self.client.post('/api/auth/otp/send/', {'mobile_number': mobile_number}, format='json')
+
+    @override_settings(SMS_BATCH_SIZE=5)
+    def test_codes_are_sent_by_the_workers(self):
+        for i in range(3):
+            self.assertEqual(self.send(f'900000000{i}').status_code, 200)
+        sms.dispatcher.stop()
+
+        outbox = sms.LocmemBackend.outbox
+        self.assertEqual(sorted(message.to for message in outbox), ['9000000000', '9000000001', '9000000002'])
+        self.assertIn('expires in 5 minutes', outbox[0].body)
+
+    @override_settings(SMS_WORKERS=0, SMS_QUEUE_SIZE=1)
+    def test_full_queue(self):
+        self.assertEqual(self.send('9000000005').status_code, 200)
+        self.assertEqual(self.send('9000000006').status_code, 503)
+
+    @override_settings(SMS_RETRY_BASE=0.01)
+    def test_failed_batch_is_retried(self):
+        calls = []
+
+        class FlakyBackend(sms.BaseSMSBackend):
+            def send_messages(self, messages):
+                calls.append(len(messages))
+                if len(calls) < 3:
+                    raise OSError('gateway down')
+
+        with self.assertLogs('shop.sms', 'WARNING') as logs:
+            sms.dispatcher.deliver(FlakyBackend(), [sms.SMSMessage('9000000001', 'Hello')])
+
+        self.assertEqual(calls, [1, 1, 1])
+        self.assertEqual(len(logs.records), 2)
+
+
+class EffectivePriceTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        call_command('refresh_effective_prices', '--all', stdout=io.StringIO())
+
+    def row(self, product):
+        return EffectivePrice.objects.get(product=product)
+
+    def assertPrice(self, product, discounted_price, promotion):
+        row = self.row(product)
+        self.assertEqual((row.discounted_price, row.promotion), (Decimal(discounted_price), promotion))
+
+    def test_product_save_refreshes_its_row(self):
+        product = self.products[0]
+        product.price = 20
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        self.assertEqual(self.row(product).price, 20)
+        self.assertPrice(product, '18.00', self.promotion)
+
+    def test_promotion_changes_refresh_rows(self):
+        self.promotion.discount_value = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promotion.save()
+        self.assertPrice(self.products[0], '5.00', self.promotion)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promotion.applicable_products.add(self.products[15])
+            self.promotion.applicable_products.remove(self.products[0])
+        self.assertPrice(self.products[15], '5.00', self.promotion)
+        self.assertPrice(self.products[0], '10.00', None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[20].promotions.add(self.promotion)
+        self.assertPrice(self.products[20], '5.00', self.promotion)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promotion.applicable_products.clear()
+        self.assertFalse(EffectivePrice.objects.filter(promotion__isnull=False).exists())
+
+    def test_promotion_delete_refreshes_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promotion.delete()
+
+        self.assertPrice(self.products[0], '10.00', None)
+        self.assertFalse(EffectivePrice.objects.filter(discounted_price__lt=10).exists())
+
+    def test_valid_until_is_the_next_promotion_boundary(self):
+        starts_at = timezone.now() + timedelta(hours=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_promotion(
+                self.vendor, [self.products[20]], code='LATER',
+                start_date=starts_at, end_date=starts_at + timedelta(days=3)
+            )
+
+        self.assertEqual(self.row(self.products[0]).valid_until, self.promotion.end_date)
+        self.assertEqual(self.row(self.products[20]).valid_until, starts_at)
+        self.assertPrice(self.products[20], '10.00', None)
+        self.assertIsNone(self.row(self.products[25]).valid_until)
+
+    def test_sweep_refreshes_only_rows_past_valid_until(self):
+        # The promotion ended a minute ago, and nothing has recomputed its rows
+        ended_at = timezone.now() - timedelta(minutes=1)
+        Promotion.objects.filter(pk=self.promotion.pk).update(end_date=ended_at)
+        EffectivePrice.objects.filter(promotion=self.promotion).update(valid_until=ended_at)
+        current = dict(EffectivePrice.objects.filter(promotion__isnull=True).values_list('product_id', 'updated_at'))
+        out = io.StringIO()
+
+        call_command('refresh_effective_prices', stdout=out)
+
+        self.assertIn('Refreshed 10 effective prices', out.getvalue())
+        self.assertPrice(self.products[0], '10.00', None)
+        self.assertEqual(
+            dict(EffectivePrice.objects.filter(product_id__in=current).values_list('product_id', 'updated_at')),
+            current
+        )
+
+
+class PromotionResolverTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        call_command('refresh_effective_prices', '--all', stdout=io.StringIO())
+
+    def test_product_list_query_count_does_not_grow_with_the_page(self):
+        # Warms the cached promotion boundaries and catalog version
+        self.client.get('/api/products/?page_size=1&sort=price')
+        counts = []
+        for page_size in (5, 30):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f'/api/products/?page_size={page_size}&sort=price')
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cart_query_count_does_not_grow_with_the_cart(self):
+        # Warms the cached promotion boundaries
+        self.client.get('/api/cart/')
+        counts = []
+        for number, size in ((1, 3), (2, 20)):
+            customer = create_customer(number)
+            cart = Cart.objects.create(customer=customer)
+            CartItem.objects.bulk_create(CartItem(cart=cart, product=product) for product in self.products[:size])
+            self.client.force_authenticate(customer.user)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.client.get('/api/cart/').json()['items']), size)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_promoted_and_unpromoted_products(self):
+        promoted, plain = self.products[0], self.products[20]
+        with self.assertNumQueries(1):
+            data = ProductSerializer([promoted, plain], many=True).data
+
+        self.assertEqual(data[0]['discounted_price'], 9.0)
+        self.assertEqual(data[0]['promotion']['promo_code'], 'SAVE')
+        self.assertIsNone(data[1]['discounted_price'])
+        self.assertIsNone(data[1]['promotion'])
+
+    def test_stale_row_is_resolved_live(self):
+        ended_at = timezone.now() - timedelta(minutes=1)
+        Promotion.objects.filter(pk=self.promotion.pk).update(end_date=ended_at)
+        EffectivePrice.objects.filter(product=self.products[0]).update(valid_until=ended_at)
+        resolver = PromotionResolver()
+
+        with self.assertNumQueries(2):
+            resolver.prime(self.products[:2])
+
+        self.assertIsNone(resolver.get(self.products[0]))
+        self.assertEqual(resolver.get_discounted_price(self.products[0]), 10)
+        # The other row is still current and trusted
+        self.assertEqual(resolver.get(self.products[1]), self.promotion)
+
+    def test_row_for_another_price_is_resolved_live(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price=20)
+        product = Product.objects.get(pk=self.products[0].pk)
+        resolver = PromotionResolver()
+
+        with self.assertNumQueries(2):
+            resolver.prime([product])
+
+        self.assertEqual(resolver.get_discounted_price(product), Decimal('18.00'))
+
+    def test_now_from_the_serializer_context(self):
+        later = timezone.now() + timedelta(days=2)
+
+        data = ProductSerializer(self.products[:1], many=True, context={'now': later}).data
+
+        self.assertIsNone(data[0]['promotion'])
+        self.assertIsNone(data[0]['discounted_price'])
+
+
+def _checkout_worker(product_ids, attempts, results):
+    # Forked children must not share the parent's database connection
+    connections.close_all()
+    sold = failed = 0
+    for attempt in range(attempts):
+        # Alternate the line order so lock ordering actually matters
+        ids = product_ids if attempt % 2 else list(reversed(product_ids))
+        try:
+            with transaction.atomic():
+                reserve_stock({product_id: 1 for product_id in ids})
+            sold += 1
+        except InsufficientStock:
+            failed += 1
+    connections.close_all()
+    results.put((sold, failed))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "needs a database shared between processes")
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Hammers two hot SKUs from several processes and checks nothing is oversold"""
+
+    processes = 8
+    attempts = 50
+    stock = 100
+
+    def test_hot_skus_are_never_oversold(self):
+        vendor = create_vendor()
+        products = [
+            Product.objects.create(vendor=vendor, name=f'Hot {i}', price=10, sku=f'HOT{i}', stock=self.stock)
+            for i in range(2)
+        ]
+        product_ids = [product.id for product in products]
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        connections.close_all()
+        workers = [
+            context.Process(target=_checkout_worker, args=(product_ids, self.attempts, results))
+            for _ in range(self.processes)
+        ]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=120) for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+        self.assertEqual([worker.exitcode for worker in workers], [0] * self.processes)
+
+        sold = sum(outcome[0] for outcome in outcomes)
+        failed = sum(outcome[1] for outcome in outcomes)
+        self.assertEqual(sold, self.stock)
+        self.assertEqual(sold + failed, self.processes * self.attempts)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=product_ids).values_list('stock', flat=True)),
+            [0, 0]
+        )
+        logger.info(
+            "%s checkouts from %s processes in %.2fs (%.0f/s, %s sold)",
+            sold + failed, self.processes, elapsed, (sold + failed) / elapsed, sold
+        )
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "needs row locks")
+class ConcurrentCartAddTests(TransactionTestCase):
+    """Adds to one customer cart from several threads and checks no increment is lost"""
+
+    threads = 8
+    adds = 10
+
+    def test_concurrent_adds_are_not_lost(self):
+        vendor = create_vendor()
+        product = Product.objects.create(vendor=vendor, name='Hot', price=10, sku='HOT', stock=100)
+        customer = create_customer(1)
+        cart = Cart.objects.create(customer=customer)
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def add():
+            try:
+                barrier.wait()
+                for _ in range(self.adds):
+                    add_item(None, cart, product, 1)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=add) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, self.threads * self.adds)
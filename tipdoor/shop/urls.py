@@ -4,8 +4,10 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path('products/', views.CustomerProductListView.as_view(), name='customer-product-list'),
+    path('products/facets/', views.ProductFacetView.as_view(), name='product-facets'),
     path('vendor/products/', views.VendorProductListCreateView.as_view(), name='vendor-product-list-create'),
     path('vendor/products/<int:pk>/', views.VendorProductDetailView.as_view(), name='vendor-product-detail'),
+    path('vendor/products/import/', views.VendorProductImportView.as_view(), name='vendor-product-import'),
     path('vendor/orders/', views.VendorOrderItemListView.as_view(), name='vendor-order-item-list'),
     path('vendor/orders/<int:order_id>/status/', views.VendorOrderStatusUpdateView.as_view(), name='vendor-order-status-update'),
     path('latest-arrivals/', views.LatestArrivalView.as_view(), name='latest-arrival'),
@@ -13,8 +15,10 @@ urlpatterns = [
     path('cart/add/', views.AddToCartView.as_view(), name='add-to-cart'),
     path('cart/update/<int:item_id>/', views.UpdateCartItemView.as_view(), name='update-cart-item'),
     path('cart/remove/<int:item_id>/', views.RemoveCartItemView.as_view(), name='remove-cart-item'),
+    path('cart/batch/', views.CartBatchView.as_view(), name='cart-batch'),
     path('user/', views.CustomerProfileView.as_view(), name='user-detail'),
     path('products/search', views.ProductSearchView.as_view(), name='product-search'),
+    path('products/suggest/', views.ProductSuggestView.as_view(), name='product-suggest'),
     path('register/', views.CustomerRegisterView.as_view(), name='register'),
     path('auth/otp/send/', views.SendOTPView.as_view(), name='send-otp'),
     path('auth/otp/verify/', views.VerifyOTPView.as_view(), name='verify-otp'),
@@ -22,6 +26,7 @@ urlpatterns = [
     path('vendor/products/<int:pk>/publish/', views.ProductPublishView.as_view(), name='product-publish'),
     path('vendor/products/<int:pk>/unpublish/', views.ProductUnpublishView.as_view(), name='product-unpublish'),
     path('orders/create/', views.OrderCreateView.as_view(), name='order-create'),
+    path('orders/quote/', views.OrderQuoteView.as_view(), name='order-quote'),
     path('orders/', views.OrderListView.as_view(), name='order-list'),
     path('vendor/promotions/', views.VendorPromotionListCreateView.as_view(), name='vendor-promotion-list-create'),
     path('vendor/promotions/<int:pk>/', views.VendorPromotionDetailView.as_view(), name='vendor-promotion-detail'),
@@ -1,34 +1,91 @@
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.conf import settings
+from django.views.static import serve
 from rest_framework import generics, status, views
-from .models import Cart, CartItem, Product, Order, OrderItem, Promotion, Customer, OTP
+from .models import Cart, CartItem, Product, Order, OrderItem, Promotion, Customer
 from vendors.models import Vendor
-from delivery.models import DeliveryPartner
 from .serializers import ProductSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, PromotionSerializer, CustomerRegistrationSerializer, CustomerSerializer, OrderStatusUpdateSerializer
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.serializers import Serializer, CharField
-from django.db.models import Q
+from django.db.models import Max, Prefetch, prefetch_related_objects
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.db import transaction
 from .permissions import IsVendor
-from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from . import serializers
 from django.core.exceptions import ValidationError
-from utils.mixins import CartMixin
-from datetime import timedelta
-import random
+from utils.mixins import CartMixin, CatalogCacheMixin, ConditionalGetMixin, IdempotencyMixin
+from utils.pagination import KeysetPagination, IdKeysetPagination, SequencePagination
+from .cart import GuestCart, add_item, apply_operations, merge_guest_cart, remove_item, update_item
+from .pricing import PricingError, get_cart_quote
+from .search import search_products
+from .suggest import suggest_index
+from .cache import get_catalog_epoch, get_catalog_last_modified, get_products_last_updated
+from .filters import PRODUCT_ORDERINGS, filter_products, product_facets
+from .importers import ProductImporter, detect_format
+from .inventory import CANCELLED, InsufficientStock, line_quantities, reserve_stock, update_order_status
+from .outbox import enqueue
+from .ratelimit import ClientIPThrottle, MobileNumberThrottle
+from .otp import generate_code, get_otp_store
+from .sms import SMSQueueFull, send_sms
+
+class CustomerProductListView(ConditionalGetMixin, generics.ListAPIView):
+    """Lists published products, filtered by vendor, price, stock and promotion"""
 
-class CustomerProductListView(generics.ListAPIView):
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+
+    def get_filters(self):
+        if not hasattr(self, '_filters'):
+            serializer = serializers.ProductFilterSerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
 
     def get_queryset(self):
-        return Product.objects.filter(is_published=True)
+        return filter_products(Product.objects.filter(is_published=True), self.get_filters())
+
+    def get_keyset_ordering(self):
+        return PRODUCT_ORDERINGS[self.get_filters()['sort']]
+
+    def get_validators(self, request, *args, **kwargs):
+        # Over every published product, not just the filtered ones: a product
+        # that stock or price moves out of the filter changes the page too
+        last_updated = get_products_last_updated()
+        last_modified = get_catalog_last_modified()
+        if last_updated:
+            last_modified = max(last_updated, last_modified)
+        parts = (request.get_full_path(), last_updated and last_updated.timestamp(), get_catalog_epoch())
+        return parts, last_modified
+
+class ProductFacetView(CatalogCacheMixin, generics.RetrieveAPIView):
+    """Counts published products per vendor, price range and stock status"""
+
+    serializer_class = serializers.ProductFilterSerializer
+    catalog_cache_prefix = 'product-facets'
+
+    def get_catalog_cache_version(self, request, *args, **kwargs):
+        # Stock status counts move with checkouts
+        last_updated = get_products_last_updated()
+        return last_updated and last_updated.timestamp()
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = {key: value for key, value in serializer.validated_data.items() if key != 'sort'}
+        queryset = filter_products(Product.objects.filter(is_published=True), filters)
+        return Response(product_facets(queryset))
 
 class SendOTPView(APIView):
     serializer_class = serializers.SendOTPSerializer
+    # Answered with 429 before any database access
+    throttle_classes = [ClientIPThrottle, MobileNumberThrottle]
+    throttle_scope = 'otp_send'
 
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
@@ -38,23 +95,23 @@ class SendOTPView(APIView):
 
         mobile_number = serializer.validated_data['mobile_number']
 
-        one_min_ago = timezone.now() - timedelta(minutes=1)
-        recent_otps = OTP.objects.filter(
-            mobile_number=mobile_number,
-            created_at__gte=one_min_ago
-        ).count()
+        otp = generate_code()
+        otp_store = get_otp_store()
+        otp_store.issue(mobile_number, otp)
 
-        if recent_otps >= 3:
+        # Queued; the gateway call happens on a worker thread
+        try:
+            send_sms(mobile_number, f"Your login code is {otp}. It expires in {settings.OTP_TTL // 60} minutes.")
+        except SMSQueueFull:
+            # Nothing was sent: drop the code and give back the send attempt
+            otp_store.discard(mobile_number, otp)
+            for throttle in self.get_throttles():
+                throttle.refund(request, self)
             return Response(
-                {'error': 'Too many OTP requests. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
+                {'error': 'Could not send the OTP right now. Please try again shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
-        otp = str(random.randint(100000, 999999))
-        OTP.objects.create(mobile_number=mobile_number, otp=otp)
-
-        print(f"OTP for {mobile_number}: {otp}")
-
         return Response({
             'message': 'OTP sent successfully',
             'mobile_number': mobile_number
@@ -62,6 +119,9 @@ class SendOTPView(APIView):
     
 class VerifyOTPView(APIView):
     serializer_class = serializers.VerifyOTPSerializer
+    # Caps guesses per number and per client
+    throttle_classes = [ClientIPThrottle, MobileNumberThrottle]
+    throttle_scope = 'otp_verify'
 
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
@@ -72,31 +132,15 @@ class VerifyOTPView(APIView):
         mobile_number = serializer.validated_data['mobile_number']
         otp = serializer.validated_data['otp']
 
-        five_min_ago = timezone.now() - timedelta(minutes=5)
-
-        try:
-            otp_obj = OTP.objects.filter(
-                mobile_number=mobile_number,
-                otp=otp,
-                is_verified=False
-            ).latest('created_at')
-
-            if not otp_obj.is_valid():
-                return Response(
-                    {'error': 'OTP has expired'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        except OTP.DoesNotExist:
+        # Checks and uses up the code in one step, so it cannot be replayed
+        if not get_otp_store().consume(mobile_number, otp):
             return Response(
-                {'error': 'Invalid OTP'},
+                {'error': 'Invalid or expired OTP'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        otp_obj.is_verified = True
-        otp_obj.save()
-
         customer = Customer.objects.filter(mobile_number=mobile_number).first()
-        created = False
+        is_new_user = False
 
         if not customer:
             user = User.objects.create_user(
@@ -107,31 +151,15 @@ class VerifyOTPView(APIView):
                 user=user,
                 mobile_number=mobile_number,
             )
-            created = True
-
-        if request.session.session_key:
-            session_cart = Cart.objects.filter(
-                        session_key=request.session.session_key,
-                        customer__isnull=True
-                    ).first()
-
-            if session_cart:
-                user_cart, _ = Cart.objects.get_or_create(customer=customer)
-                for item in session_cart.items.all():
-                    cart_item, created = user_cart.items.get_or_create(
-                        product=item.product,
-                        defaults={'quantity': item.quantity}
-                    )
-                    if not created:
-                        cart_item.quantity += item.quantity
-                        cart_item.save()
-                session_cart.delete()
+            is_new_user = True
+
+        merge_guest_cart(request, customer)
 
         refresh = RefreshToken.for_user(customer.user)
 
         return Response({
             'message': 'Login successful',
-            'is_new_user': created,
+            'is_new_user': is_new_user,
             'refresh': str(refresh),
             'access': str(refresh.access_token),
             'user': {
@@ -140,19 +168,44 @@ class VerifyOTPView(APIView):
             }
         }, status=status.HTTP_200_OK)
 
-class LatestArrivalView(generics.ListAPIView):
+class LatestArrivalView(CatalogCacheMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
+    catalog_cache_prefix = 'latest-arrivals'
+
+    def get_catalog_cache_version(self, request, *args, **kwargs):
+        last_updated = get_products_last_updated()
+        return last_updated and last_updated.timestamp()
 
     def get_queryset(self):
         return Product.objects.filter(is_published=True).order_by('-created_at')[:5]
 
-class CartView(CartMixin, generics.RetrieveAPIView):
+class CartView(ConditionalGetMixin, CartMixin, generics.RetrieveAPIView):
     """Gets the user's cart"""
 
     serializer_class = CartSerializer
 
     def get_object(self):
-        return self.get_cart(self.request)
+        if not hasattr(self, '_cart'):
+            self._cart = self.get_cart(self.request)
+        return self._cart
+
+    def get_validators(self, request, *args, **kwargs):
+        cart = self.get_object()
+        if isinstance(cart, GuestCart):
+            products_updated = max((item.product.updated_at for item in cart.items), default=None)
+        else:
+            products_updated = cart.items.aggregate(last_updated=Max('product__updated_at'))['last_updated']
+        # A guest cart that was never saved is empty and its timestamps are
+        # just the time of this request, so they must not move the validators
+        updated_at = cart.updated_at if not isinstance(cart, GuestCart) or cart.stored else None
+        last_modified = max(filter(None, [updated_at, products_updated, get_catalog_last_modified()]))
+        parts = (cart.pk, updated_at and updated_at.timestamp(), products_updated and products_updated.timestamp(), get_catalog_epoch())
+        return parts, last_modified
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        patch_cache_control(response, private=True)
+        return response
 
 class AddToCartView(CartMixin, APIView):
     """Adds an item to the cart"""
@@ -171,13 +224,7 @@ class AddToCartView(CartMixin, APIView):
             return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
 
         cart = self.get_cart(request)
-
-        cart_item, item_created = CartItem.objects.get_or_create(
-            cart=cart, product=product, defaults={'quantity': quantity}
-        )
-        if not item_created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        add_item(request, cart, product, quantity)
         serializer = CartSerializer(cart, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -193,15 +240,10 @@ class UpdateCartItemView(CartMixin, APIView):
 
         cart = self.get_cart(request)
 
-        try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            cart_item.quantity = quantity
-            cart_item.save()
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data)
-
-        except CartItem.DoesNotExist:
+        if not update_item(request, cart, item_id, quantity):
             return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+        serializer = CartSerializer(cart, context={'request': request})
+        return Response(serializer.data)
 
 class RemoveCartItemView(CartMixin, APIView):
     """Remove an item from the cart"""
@@ -211,14 +253,42 @@ class RemoveCartItemView(CartMixin, APIView):
     def delete(self, request, item_id):
         cart = self.get_cart(request)
 
-        try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            cart_item.delete()
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data)
-
-        except CartItem.DoesNotExist:
+        if not remove_item(request, cart, item_id):
             return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+        serializer = CartSerializer(cart, context={'request': request})
+        return Response(serializer.data)
+
+class CartBatchView(CartMixin, APIView):
+    """
+    Applies many add/set/remove operations to the cart in one request. With
+    response=delta only the changed lines, removed line ids and new totals
+    are returned instead of the whole cart.
+    """
+
+    serializer_class = serializers.CartBatchSerializer
+
+    def post(self, request):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        operations = input_serializer.validated_data['operations']
+
+        product_ids = {operation['product_id'] for operation in operations if operation['op'] != 'remove'}
+        products = Product.objects.in_bulk(product_ids)
+        missing = {
+            index: {'product_id': ["Product not found"]}
+            for index, operation in enumerate(operations)
+            if operation['op'] != 'remove' and operation['product_id'] not in products
+        }
+        if missing:
+            return Response({'operations': missing}, status=status.HTTP_404_NOT_FOUND)
+
+        cart = self.get_cart(request)
+        changed, removed = apply_operations(request, cart, operations, products)
+
+        context = {'request': request}
+        if input_serializer.validated_data['response'] == 'delta':
+            return Response(serializers.serialize_cart_delta(cart, changed, removed, context))
+        return Response(CartSerializer(cart, context=context).data)
 
 class CustomerProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = CustomerSerializer
@@ -228,90 +298,122 @@ class CustomerProfileView(generics.RetrieveUpdateAPIView):
         return self.request.user.customer
 
 class ProductSearchView(generics.ListAPIView):
+    """Searches published products by name and SKU, best matches first"""
+
     serializer_class = ProductSerializer
+    pagination_class = SequencePagination
 
     def get_queryset(self):
-        query = self.request.GET.get('q', '').strip()
-        if query:
-            queryset = Product.objects.filter(Q(name__icontains=query), is_published=True)
-        else:
-            return Product.objects.none()
-        return queryset
+        return Product.objects.filter(is_published=True)
+
+    def list(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        product_ids = search_products(query) if query else []
+
+        page_ids = self.paginate_queryset(product_ids)
+        products = self.get_queryset().in_bulk(page_ids)
+        page = [products[product_id] for product_id in page_ids if product_id in products]
+
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class ProductSuggestView(APIView):
+    """Completes a partly typed product name or SKU from the in-memory suggestion index"""
+
+    # Served without any database access, so skip session/JWT user lookups
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        try:
+            limit = min(int(request.GET.get('limit', settings.SUGGEST_LIMIT)), settings.SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "limit must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'query': query, 'results': suggest_index.suggest(query, limit)})
 
 class CustomerRegisterView(generics.CreateAPIView):
     serializer_class = CustomerRegistrationSerializer
     permission_classes = [AllowAny]
 
-class OrderCreateView(APIView):
+class OrderCreateView(IdempotencyMixin, APIView):
+    """Places an order for the cart; retries with the same Idempotency-Key replay the first result"""
+
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
 
-    def post(self, request):
+    def create(self, request):
         shipping_address = request.data.get('shippingAddress', {})
         promo_code = request.data.get('promo_code', '')
 
         self._validate_shipping(shipping_address)
 
         cart_user, created = Cart.objects.get_or_create(customer=request.user.customer)
-        cart_items = CartItem.objects.filter(cart=cart_user)
 
-        if not cart_items:
-            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            quote = get_cart_quote(cart_user, promo_code)
+        except PricingError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        promotion = self._get_valid_promotion(promo_code, cart_items)
+        if not quote.lines:
+            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            try:
-                total_amount = sum(item.product.price * item.quantity for item in cart_items)
-                discounted_total = total_amount
-                order_items_data = []
-
-                for item in cart_items:
-                    price = item.product.price
-                    discounted_price = price
-                    if promotion and promotion.applicable_products.filter(id=item.product.id).exists():
-                        if promotion.discount_type == 'percentage':
-                            discounted_price = price * (1 - promotion.discount_value / 100)
-                        elif promotion.discount_type == 'fixed':
-                            discounted_price = max(0, price - promotion.discount_value)
-                    discounted_total -= (price - discounted_price) * item.quantity
-                    order_items_data.append({
-                        'product': item.product,
-                        'quantity': item.quantity,
-                        'price': price,
-                        'discounted_price': discounted_price
-                    })
-
-                order = Order.objects.create(
-                    user=request.user.customer,
-                    address=shipping_address['address'],
-                    city=shipping_address['city'],
-                    postal_code=shipping_address['postal_code'],
-                    country=shipping_address['country'],
-                    total_amount=total_amount,
-                    promo_code=promo_code if promotion else None,
-                    status='Pending'
-                )
-
-                for item_data in order_items_data:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=item_data['product'],
-                        quantity=item_data['quantity'],
-                        price=item_data['price'],
-                        discounted_price=item_data['discounted_price'] if item_data['discounted_price'] != item_data['price'] else None
+        try:
+            with transaction.atomic():
+                # Reserve first, so the whole order rolls back if any line is short
+                reserve_stock(line_quantities((line.product_id, line.quantity) for line in quote.lines))
+                try:
+                    order = Order.objects.create(
+                        user=request.user.customer,
+                        address=shipping_address['address'],
+                        city=shipping_address['city'],
+                        postal_code=shipping_address['postal_code'],
+                        country=shipping_address['country'],
+                        total_amount=quote.subtotal,
+                        discounted_total=quote.total,
+                        promo_code=quote.promo_code,
+                        status='Pending'
                     )
 
-                cart_items.delete()  # Clear cart after order
-
-                serializer = OrderSerializer(order, context={'request': request, 'promo_code': promo_code})
-                response_data = serializer.data
-                response_data['order_id'] = order.id
-                response_data['message'] = 'Order created successfully'
-
-                return Response(response_data, status=status.HTTP_201_CREATED)
-            except Exception as e:
-                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                    OrderItem.objects.bulk_create([
+                        OrderItem(
+                            order=order,
+                            product_id=line.product_id,
+                            quantity=line.quantity,
+                            price=line.price,
+                            discounted_price=line.discounted_price
+                        )
+                        for line in quote.lines
+                    ])
+
+                    CartItem.objects.filter(cart=cart_user).delete()  # Clear cart after order
+
+                    # The lines were just written, so serialize them without reloading
+                    prefetch_related_objects([order], Prefetch('items', queryset=OrderItem.objects.select_related('product', 'order__user')))
+                    serializer = OrderSerializer(order, context={'request': request})
+                    response_data = serializer.data
+                    response_data['order_id'] = order.id
+                    response_data['message'] = 'Order created successfully'
+
+                    return Response(response_data, status=status.HTTP_201_CREATED)
+                except Exception as e:
+                    # Do not keep the reserved stock of an order that was not placed
+                    transaction.set_rollback(True)
+                    return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock as e:
+            products = Product.objects.in_bulk(e.shortfalls)
+            lines = [
+                {
+                    'product_id': line.product_id,
+                    'name': products[line.product_id].name if line.product_id in products else None,
+                    'requested': line.quantity,
+                    'available': e.shortfalls[line.product_id],
+                }
+                for line in quote.lines if line.product_id in e.shortfalls
+            ]
+            return Response({'error': 'Insufficient stock', 'lines': lines}, status=status.HTTP_409_CONFLICT)
 
     def _validate_shipping(self, shipping_address):
         if not all([
@@ -322,38 +424,31 @@ class OrderCreateView(APIView):
         ]):
             raise ValidationError('All fields are required')
 
-    def _get_valid_promotion(self, promo_code, cart_items):
-        if not promo_code:
-            return None
-        now = timezone.now()
-        try:
-            promotion = Promotion.objects.get(
-                promo_code=promo_code,
-                is_active=True,
-                start_date__lte=now,
-                end_date__gte=now
-            )
-        except Promotion.DoesNotExist:
-            raise ValidationError('Invalid or inactive promo code')
-
-        applicable = any(
-            promotion.applicable_products.filter(id=item.product.id).exists()
-            for item in cart_items
-        )
-        if not applicable:
-            raise ValidationError('Promo code does not apply to any items in the cart')
+class OrderQuoteView(CartMixin, APIView):
+    """Prices the cart with an optional promo code, exactly as checkout would charge it"""
 
-        return promotion
+    def get(self, request):
+        cart = self.get_cart(request)
+        try:
+            quote = get_cart_quote(cart, request.GET.get('promo_code', ''))
+        except PricingError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(quote.as_dict())
 
 class OrderListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         customer = getattr(self.request.user, 'customer', None)
         if not customer:
             return Order.objects.none()
-        return Order.objects.filter(user=self.request.user.customer).order_by('-created_at')
+        # Totals and line prices are stored, so a page costs one query for
+        # the orders and one for all of their items
+        return Order.objects.filter(user=customer).select_related('user').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
 
 class ProductPublishView(views.APIView):
     permission_classes = [IsAuthenticated, IsVendor]
@@ -383,13 +478,26 @@ class ProductUnpublishView(views.APIView):
         except Product.DoesNotExist:
             return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
 
-class ProductDetailView(generics.RetrieveAPIView):
+class ProductDetailView(ConditionalGetMixin, CatalogCacheMixin, generics.RetrieveAPIView):
     serializer_class = ProductSerializer
     lookup_field = 'pk'
+    catalog_cache_prefix = 'product-detail'
 
     def get_queryset(self):
         return Product.objects.filter(is_published=True)
 
+    def get_validators(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+        updated_at = self.get_queryset().filter(pk=pk).values_list('updated_at', flat=True).first()
+        self.updated_at = updated_at
+        if updated_at is None:
+            return None, None
+        return (pk, updated_at.timestamp(), get_catalog_epoch()), max(updated_at, get_catalog_last_modified())
+
+    def get_catalog_cache_version(self, request, *args, **kwargs):
+        # Set by get_validators(), which runs first
+        return self.updated_at and self.updated_at.timestamp()
+
 class VendorProductDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated, IsVendor]
@@ -401,6 +509,7 @@ class VendorProductDetailView(generics.RetrieveUpdateDestroyAPIView):
 class VendorProductListCreateView(generics.ListCreateAPIView):
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated, IsVendor]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Product.objects.filter(vendor=self.request.user.vendor)
@@ -408,12 +517,35 @@ class VendorProductListCreateView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         serializer.save(vendor=self.request.user.vendor)
 
+class VendorProductImportView(generics.GenericAPIView):
+    """
+    Creates or updates the vendor's products in bulk from an uploaded CSV or
+    JSON-lines file keyed by sku. Returns counts and a per-row error report.
+    """
+
+    permission_classes = [IsAuthenticated, IsVendor]
+    parser_classes = [MultiPartParser]
+    serializer_class = serializers.ProductImportSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        file_format = serializer.validated_data.get('format') or detect_format(upload.name, upload.content_type)
+        if file_format is None:
+            return Response({"error": "Could not detect the file format, pass format=csv or format=jsonl"}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = ProductImporter(request.user.vendor).run(upload.file, file_format)
+        return Response(report, status=status.HTTP_200_OK)
+
 class VendorOrderItemListView(generics.ListAPIView):
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated, IsVendor]
+    # Order items are written together with their order, so id follows creation time
+    pagination_class = IdKeysetPagination
 
     def get_queryset(self):
-        return OrderItem.objects.filter(product__vendor__user=self.request.user).select_related('order', 'product')
+        return OrderItem.objects.filter(product__vendor__user=self.request.user).select_related('order__user', 'product')
 
     def get_serializer_context(self):
         return {'request': self.request}
@@ -455,16 +587,18 @@ class VendorOrderStatusUpdateView(generics.GenericAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        order.status = new_status
-        order.save(update_fields=["status"])
+        with transaction.atomic():
+            # Conditional update, so a concurrent cancellation is never overwritten
+            updated = update_order_status(order, new_status)
+            if updated and new_status == "APPROVED":
+                # Delivery partners are notified by the outbox worker, after commit
+                enqueue('order.approved', {'order_id': order.pk})
 
-        if new_status == "APPROVED":
-            active_partners = DeliveryPartner.objects.filter(
-                is_available=True,
-                service_area__contains=order.address
+        if not updated and new_status != CANCELLED:
+            return Response(
+                {"error": "Cancelled orders cannot be reopened"},
+                status=status.HTTP_409_CONFLICT
             )
-            for partner in active_partners:
-                send_notification(partner, order)
 
         return Response(
             {"message": f"Order status updated to {new_status}"},
@@ -495,8 +629,11 @@ class VendorPromotionDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_serializer_context(self):
         return {'request': self.request}
 
+def derived_image(request, path):
+    """Serves image derivatives; their paths are content-hashed so they never change"""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT / 'derived')
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
 def index(request):
     return HttpResponse("Hello, world. You're at shop.")
-
-def send_notification(partner, order):
-    print("Send notification function")
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'drf_spectacular',
@@ -131,7 +132,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'shop.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -140,6 +141,185 @@ REST_AUTH = {
     'USE_JWT': True,
 }
 
+# Caching
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# CACHE_BACKEND picks the store: "redis" (any Redis-compatible server at
+# REDIS_URL), "file" (shared by the workers on one host) or "locmem". Local
+# memory is per process, so it is only suitable with a single worker. The
+# file cache lists its whole directory on every write to decide whether to
+# cull, which slows down as guest carts and sessions pile up: it is meant for
+# development and small single-host setups. Deployments with several workers
+# should set REDIS_URL (render.yaml does).
+
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or ('redis' if REDIS_URL else 'locmem' if DEBUG else 'file')
+
+# The "carts" cache holds guest carts and "sessions" the sessions when they
+# are cached. Unlike the other entries they cannot be rebuilt, so they are
+# kept apart from the default cache and never culled early. "versions" holds
+# the few counters the catalog and search caches are keyed on, which must
+# not be culled with the entries they version.
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'carts',
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'sessions',
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'versions',
+        },
+    }
+elif CACHE_BACKEND == 'file':
+    CACHE_DIR = os.environ.get('CACHE_DIR', BASE_DIR / '.cache')
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+            # Catalog pages, quotes, search results, users and rate limits
+            'OPTIONS': {'MAX_ENTRIES': 50_000},
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'carts'),
+            'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'sessions'),
+            'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'versions'),
+            'TIMEOUT': None,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'carts',
+            'OPTIONS': {'MAX_ENTRIES': 100_000},
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sessions',
+            'OPTIONS': {'MAX_ENTRIES': 100_000},
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'versions',
+            'TIMEOUT': None,
+        },
+    }
+
+VERSION_CACHE = 'versions'
+
+CATALOG_CACHE_TIMEOUT = 60 * 60  # seconds
+
+# Sessions
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/
+#
+# SESSION_BACKEND picks the store: "signed_cookies" (in the cookie itself),
+# "cache" (the "sessions" cache), "cached_db" or "db". Only the last two
+# write guest sessions to the database. Sessions of the database store used
+# before are carried over by the first two (see shop.sessions).
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'signed_cookies'
+SESSION_ENGINES = {
+    'signed_cookies': 'shop.sessions.signed_cookies',
+    'cache': 'shop.sessions.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+}
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_LEGACY_ENGINE = os.environ.get('SESSION_LEGACY_ENGINE', 'django.contrib.sessions.backends.db') or None
+
+# Authenticated users and their customer/vendor profiles, see shop.authentication
+AUTH_USER_CACHE_TIMEOUT = 60  # seconds
+
+# Guest carts expire this long after their last change
+GUEST_CART_CACHE = 'carts'
+GUEST_CART_TTL = 60 * 60 * 24 * 7  # seconds
+CART_BATCH_MAX_OPERATIONS = 100
+QUOTE_CACHE_TIMEOUT = 60 * 15  # seconds
+
+# Upper bounds of the price ranges counted by the product facets endpoint
+PRODUCT_PRICE_BUCKETS = (25, 50, 100, 250, 500)
+
+# Bulk product import: rows per transaction, and errors kept in the report
+PRODUCT_IMPORT_CHUNK_SIZE = 500
+PRODUCT_IMPORT_MAX_ERRORS = 1000
+
+# Product search
+SEARCH_MAX_RESULTS = 200
+SEARCH_CACHE_TIMEOUT = 300  # seconds
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+# How often each process checks whether another one changed the catalog
+SUGGEST_VERSION_POLL_INTERVAL = 5  # seconds
+
+# One-time login codes (shop.otp). The cache store needs a cache shared by
+# every worker, so it is only the default with Redis.
+OTP_STORE = os.environ.get('OTP_STORE') or ('cache' if CACHE_BACKEND == 'redis' else 'database')
+OTP_CACHE = 'default'
+OTP_TTL = 60 * 5  # seconds
+
+# Outgoing SMS (shop.sms): the backend, and the in-process queue and worker
+# pool that deliver through it
+SMS_BACKEND = os.environ.get('SMS_BACKEND', 'shop.sms.ConsoleBackend')
+SMS_FILE_PATH = os.environ.get('SMS_FILE_PATH', BASE_DIR / 'sms.log')
+SMS_HTTP_URL = os.environ.get('SMS_HTTP_URL', 'http://127.0.0.1:8025/messages')
+SMS_TIMEOUT = 5  # seconds per batch
+SMS_WORKERS = 2
+SMS_QUEUE_SIZE = 1000
+SMS_BATCH_SIZE = 20
+SMS_MAX_ATTEMPTS = 3
+SMS_RETRY_BASE = 0.5  # seconds, doubled after every failed attempt
+SMS_SHUTDOWN_TIMEOUT = 5  # seconds
+
+# Token-bucket limits per view scope and key: (requests, seconds to refill them)
+RATELIMIT_CACHE = 'default'
+RATE_LIMITS = {
+    'otp_send': {'mobile_number': (3, 60), 'ip': (20, 60)},
+    'otp_verify': {'mobile_number': (5, 60 * 5), 'ip': (30, 60)},
+}
+
+# Transactional outbox, delivered by `manage.py run_outbox`
+OUTBOX_HANDLERS = {
+    'order.approved': 'shop.notifications.notify_delivery_partners',
+    'delivery.notify': 'shop.notifications.notify_delivery_partner',
+}
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_LEASE = 60 * 5  # seconds a claimed message stays hidden from other workers
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE = 10  # seconds, doubled after every failed attempt
+OUTBOX_RETRY_MAX = 60 * 60  # seconds
+
+# Retention of rows removed by `manage.py purge_stale_data`
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24  # seconds
+OUTBOX_RETENTION = 60 * 60 * 24 * 7  # seconds, delivered messages only
+PURGE_BATCH_SIZE = 1000
+PURGE_SLEEP = 0.1  # seconds between batches
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -161,6 +341,15 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Resized derivatives of uploaded images, built by a background thread pool
+IMAGE_DERIVATIVE_WIDTHS = {
+    'product': (320, 640, 1024),
+    'promotion': (640, 1280, 1920),
+}
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_WORKERS = 2
+IMAGE_DERIVATIVES_ASYNC = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
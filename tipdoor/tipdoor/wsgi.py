@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tipdoor.settings')
 
 application = get_wsgi_application()
+
+# Each worker builds its product suggestion index before serving requests
+from shop.suggest import warm_suggest_index  # noqa: E402
+
+warm_suggest_index()
@@ -1,13 +1,135 @@
-from shop.models import Cart
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from shop.cache import catalog_cache_key
+from shop.cart import get_cart
+from shop.models import IdempotencyKey
 
 class CartMixin:
     def get_cart(self, request):
-        if request.user.is_authenticated:
-            cart, _ = Cart.objects.get_or_create(customer=request.user.customer)
-            return cart
-
-        if not request.session.session_key:
-            request.session.create()
-        
-        cart, _ = Cart.objects.get_or_create(session_key=request.session.session_key)
-        return cart
+        # Customers get their database cart, guests a cache-backed GuestCart
+        return get_cart(request)
+
+class CatalogCacheMixin:
+    """
+    Caches successful GET responses of catalog views. Entries are keyed by
+    the catalog epoch, so product and promotion changes invalidate them, and
+    by get_catalog_cache_version(), for what moves without the epoch (stock).
+    """
+
+    catalog_cache_prefix = None
+
+    def get_catalog_cache_version(self, request, *args, **kwargs):
+        return None
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_catalog_cache_version(request, *args, **kwargs)
+        key = catalog_cache_key(request, self.catalog_cache_prefix, version)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match / If-Modified-Since with 304 before the view does
+    any serialization. Views implement get_validators(), returning the parts
+    of an ETag and a Last-Modified datetime from cheap queries.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        parts, last_modified = self.get_validators(request, *args, **kwargs)
+        etag = None
+        if parts is not None:
+            digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+            etag = quote_etag(digest)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        if etag:
+            response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+        # Let clients keep the body but always revalidate it
+        patch_cache_control(response, no_cache=True)
+        return response
+
+class IdempotencyMixin:
+    """
+    Makes POST safe to retry when the client sends an Idempotency-Key header.
+
+    The key is claimed with an insert on its unique (customer, key) index in
+    the same transaction as the view's work, so a concurrent duplicate blocks
+    on the index until the first request finishes, and then replays its
+    stored response. Views implement create() instead of post().
+    """
+
+    idempotency_header = 'Idempotency-Key'
+
+    def create(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        if key is None:
+            return self.create(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            return Response({'error': f'{self.idempotency_header} must be 1 to 255 characters'}, status=status.HTTP_400_BAD_REQUEST)
+
+        customer = request.user.customer
+        payload = json.dumps({'path': request.path, 'data': request.data}, sort_keys=True, default=str)
+        request_hash = hashlib.sha256(payload.encode()).hexdigest()
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(customer=customer, key=key, request_hash=request_hash)
+            except IntegrityError:
+                return self.replay(IdempotencyKey.objects.get(customer=customer, key=key), request_hash)
+
+            response = self.create(request, *args, **kwargs)
+            if not status.is_success(response.status_code):
+                # Drop the claim with the rest of the transaction so the client can retry
+                transaction.set_rollback(True)
+                return response
+
+            record.status_code = response.status_code
+            record.response_body = JSONRenderer().render(response.data).decode()
+            record.save(update_fields=['status_code', 'response_body'])
+        return response
+
+    def replay(self, record, request_hash):
+        if record.request_hash != request_hash:
+            return Response(
+                {'error': f'{self.idempotency_header} was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if record.status_code is None:
+            response = Response({'error': 'A request with this key is still in progress'}, status=status.HTTP_409_CONFLICT)
+            response.headers['Retry-After'] = '1'
+            return response
+        response = HttpResponse(record.response_body, status=record.status_code, content_type='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
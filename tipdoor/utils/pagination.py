@@ -0,0 +1,238 @@
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over a fixed ordering, `(created_at, id)` by default.
+
+    Every page is a `WHERE (created_at, id) < (last seen)` predicate plus a
+    LIMIT, so deep pages cost the same as the first one and no COUNT(*) is
+    issued. Cursors are opaque tokens encoding the position of the edge row.
+    The ordering fields must be non-null and end with a unique field.
+    """
+
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(self.get_ordering(request, queryset, view))
+
+        position, reverse = self.decode_cursor(request, queryset)
+        ordering = tuple(self._flip(field) for field in self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, position))
+
+        # Fetch one extra row to know whether another page exists
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_ordering(self, request, queryset, view):
+        # Views with request-dependent sorting provide their own ordering
+        if hasattr(view, 'get_keyset_ordering'):
+            return view.get_keyset_ordering()
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': [self._dump_value(value) for value in position]}
+        if reverse:
+            payload['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(remove_query_param(self.base_url, self.cursor_query_param), self.cursor_query_param, token)
+
+    def decode_cursor(self, request, queryset):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self._get_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            if any(value is None for value in position):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, bool(payload.get('r'))
+
+    def _position(self, obj):
+        position = []
+        for field in self.ordering:
+            value = obj
+            for attr in field.lstrip('-').split(LOOKUP_SEP):
+                value = getattr(value, attr)
+            position.append(value)
+        return position
+
+    def _seek_filter(self, ordering, position):
+        # (a, b) < (x, y)  =>  a < x OR (a = x AND b < y)
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _get_field(queryset, path):
+        if path in queryset.query.annotations:
+            return queryset.query.annotations[path].output_field
+        model = queryset.model
+        *relations, name = path.split(LOOKUP_SEP)
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
+    @staticmethod
+    def _dump_value(value):
+        # Keep full precision; DjangoJSONEncoder truncates microseconds
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+
+class IdKeysetPagination(KeysetPagination):
+    """Keyset pagination for rows without their own timestamp, newest id first"""
+
+    ordering = ('-id',)
+
+
+class SequencePagination(KeysetPagination):
+    """
+    Cursor pagination over an already ordered, bounded list such as ranked
+    search hits. The cursor stores the offset into the list.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.offset = self.decode_offset(request)
+
+        self.page = list(queryset[self.offset:self.offset + self.page_size])
+        self.has_next = self.offset + self.page_size < len(queryset)
+        self.has_previous = self.offset > 0
+        return self.page
+
+    def decode_offset(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return 0
+        try:
+            offset = int(json.loads(base64.urlsafe_b64decode(token.encode()))['p'][0])
+        except (TypeError, ValueError, KeyError, IndexError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if offset < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return offset
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor([self.offset + self.page_size], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor([max(self.offset - self.page_size, 0)], reverse=False)